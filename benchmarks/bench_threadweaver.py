@@ -0,0 +1,447 @@
+'''
+Offline load simulation for Threadweaver's hot paths.
+
+Builds a synthetic bot (hundreds of guilds, thousands of channels) out of the stand-ins in fakes.py, replays
+reaction streams and archive runs through the cog, and reports handler latency percentiles and REST calls per
+event.  Run it from the repository root:
+
+    python -m benchmarks.bench_threadweaver [--guilds 200] [--rest-latency-ms 0] [--json results.json]
+'''
+from collections import Counter
+from datetime import datetime, timedelta
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+import discord
+
+import threadweaver.threadweaver as threadweaver_module
+from threadweaver.threadweaver import Threadweaver, CATEGORY_CHANNEL_LIMIT, TRANSCRIPT_HEADROOM
+from .fakes import FakeClient, FakeConfig, FakeGuild, FakeResponse, make_reaction, make_snowflake
+
+TRIGGER_EMOJI = "🧵"
+NOISE_EMOJI   = ["👍", "😂", "❤️", "🎉", "👀", "🔥", "✅", "🙏"]
+
+class Result:
+    '''Latencies and REST calls collected while running one scenario'''
+
+    def __init__(self, name : str):
+        self.name       : str         = name
+        self.latencies  : list[float] = [] # seconds, one per handler call
+        self.rest_calls : Counter     = Counter()
+        self.notes      : dict        = {}
+
+    def percentile(self, fraction : float) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def as_dict(self) -> dict:
+        events = len(self.latencies)
+        total  = sum(self.rest_calls.values())
+        return {
+            "scenario"       : self.name,
+            "events"         : events,
+            "p50_ms"         : round(self.percentile(0.50) * 1000, 3),
+            "p90_ms"         : round(self.percentile(0.90) * 1000, 3),
+            "p99_ms"         : round(self.percentile(0.99) * 1000, 3),
+            "max_ms"         : round(max(self.latencies, default=0) * 1000, 3),
+            "rest_calls"     : total,
+            "rest_per_event" : round(total / events, 3) if events else 0.0,
+            "endpoints"      : dict(self.rest_calls.most_common()),
+            **self.notes
+        }
+
+class World:
+    '''The synthetic guilds, their members and the messages people react to'''
+
+    def __init__(self, client : FakeClient, args, rng : random.Random):
+        self.client  = client
+        self.rng     = rng
+        self.sources : dict[int, list] = {} # guild id -> [(channel, message)] without threads
+        self.threads : dict[int, list] = {} # guild id -> [(channel, source message id)] that already have threads
+        self.guilds  : list[FakeGuild] = [] # Only these; scenarios that set up a guild of their own keep it out of the shared world
+
+        for guild_index in range(args.guilds):
+            guild = FakeGuild(client, make_snowflake(), "guild-" + str(guild_index))
+            client.add_guild(guild)
+            self.guilds.append(guild)
+            for member_index in range(args.members):
+                guild.add_member("member-" + str(member_index))
+            members = [member for member in guild.members if member is not guild.me]
+
+            category = guild.add_category("══════ ❖ THREADS ❖ ══════")
+            guild.add_text_channel("📓｜thread_archive", "This channel records conversations from old threads.", category)
+
+            self.sources[guild.id] = []
+            for channel_index in range(args.channels_per_guild):
+                channel = guild.add_text_channel("channel-" + str(channel_index))
+                for _ in range(args.messages_per_channel):
+                    message = channel.add_message(rng.choice(members), "Something worth discussing")
+                    self.sources[guild.id].append((channel, message))
+
+            # Some of the messages already have threads, with a bit of conversation in them
+            self.threads[guild.id] = []
+            for channel, message in rng.sample(self.sources[guild.id], min(args.threads_per_guild, len(self.sources[guild.id]))):
+                self.sources[guild.id].remove((channel, message))
+                thread = guild.add_text_channel("🧵｜thread_" + message.author.name,
+                    "[THREAD] " + str(message.id) + " By <@" + str(message.author.id) + ">: \n" + message.content, category)
+                started = datetime.utcnow() - timedelta(hours=1)
+                for index in range(10):
+                    thread.add_message(rng.choice(members), "reply " + str(index), started + timedelta(minutes=index))
+                self.threads[guild.id].append((thread, channel, message.id))
+
+    def random_guild(self) -> FakeGuild:
+        return self.rng.choice(self.guilds)
+
+    def members(self, guild : FakeGuild) -> list:
+        return [member for member in guild.members if member is not guild.me]
+
+    def long_thread(self, cog, guild : FakeGuild, length : int):
+        '''Adds (and registers) a thread with `length` messages of varying size'''
+        members = self.members(guild)
+        thread  = guild.add_text_channel("🧵｜thread_long", "[THREAD] " + str(make_snowflake()) + " By <@" + str(members[0].id) + ">: \n",
+                                         guild.categories[0])
+        started = datetime.utcnow() - timedelta(days=1)
+        for index in range(length):
+            thread.add_message(self.rng.choice(members), "message number " + str(index) + " " + "lorem ipsum " * self.rng.randint(1, 20),
+                               started + timedelta(seconds=index))
+        cog.register_thread(thread)
+        return thread
+
+async def settle(cog : Threadweaver, timeout : float = 30):
+    '''Waits for the work handlers left running in the background (debounced joins, gateway events) to finish'''
+    long_lived = { cog.init_task, cog.stats_log_task, *cog.prune_tasks.values() } # Archive jobs are not; settling waits for them
+    deadline   = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        pending = [task for task in asyncio.all_tasks()
+                   if task is not asyncio.current_task() and task not in long_lived and not task.done()]
+        if not pending:
+            return
+        await asyncio.wait(pending, timeout=max(0.0, deadline - time.perf_counter()))
+
+async def timed(result : Result, coroutine):
+    start = time.perf_counter()
+    await coroutine
+    result.latencies.append(time.perf_counter() - start)
+
+def rest_snapshot(client : FakeClient) -> Counter:
+    return Counter(client.rest_calls)
+
+async def run_noise(cog, client, world, args) -> Result:
+    '''Ordinary (non-trigger) reactions spread over every guild; these should cost nothing'''
+    result = Result("noise reactions")
+    before = rest_snapshot(client)
+    for index in range(args.noise):
+        guild = world.random_guild()
+        channel, message = world.rng.choice(world.sources[guild.id])
+        payload = make_reaction(guild, channel, message.id, world.rng.choice(world.members(guild)),
+                                world.rng.choice(NOISE_EMOJI), added=index % 3 != 0)
+        handler = cog.on_raw_reaction_add if payload.event_type == "REACTION_ADD" else cog.on_raw_reaction_remove
+        await timed(result, handler(payload))
+    await settle(cog)
+    result.rest_calls = rest_snapshot(client) - before
+    return result
+
+async def run_burst(cog, client, world, args) -> Result:
+    '''Many people adding 🧵 to the same fresh message at once, in several guilds at the same time'''
+    result  = Result("thread bursts")
+    before  = rest_snapshot(client)
+    targets = []
+    for _ in range(args.bursts):
+        guild = world.random_guild()
+        if not world.sources[guild.id]:
+            continue
+        channel, message = world.sources[guild.id].pop()
+        targets.append((guild, channel, message))
+
+    async def burst(guild, channel, message):
+        reactors = world.rng.sample(world.members(guild), min(args.burst_size, len(world.members(guild))))
+        await asyncio.gather(*(timed(result, cog.on_raw_reaction_add(make_reaction(guild, channel, message.id, member, TRIGGER_EMOJI)))
+                               for member in reactors))
+    await asyncio.gather(*(burst(*target) for target in targets))
+    await settle(cog)
+    result.rest_calls = rest_snapshot(client) - before
+
+    # Every burst should have produced exactly one thread
+    created = Counter()
+    for guild, channel, message in targets:
+        for thread in guild.text_channels:
+            if thread.topic and thread.topic.startswith("[THREAD] " + str(message.id)):
+                created[message.id] += 1
+    result.notes["threads_created"]   = sum(created.values())
+    result.notes["duplicate_threads"] = sum(count - 1 for count in created.values() if count > 1)
+    result.notes["missing_threads"]   = len(targets) - len(created)
+    for guild, channel, message in targets:
+        for thread in guild.text_channels:
+            if thread.topic and thread.topic.startswith("[THREAD] " + str(message.id)):
+                world.threads[guild.id].append((thread, channel, message.id))
+    return result
+
+async def run_churn(cog, client, world, args) -> Result:
+    '''People toggling 🧵 on and off on messages that already have threads'''
+    result = Result("join/leave churn")
+    before = rest_snapshot(client)
+    batch  = []
+    for index in range(args.churn):
+        guild = world.random_guild()
+        if not world.threads[guild.id]:
+            continue
+        thread, channel, message_id = world.rng.choice(world.threads[guild.id])
+        if guild.get_channel(thread.id) is None:
+            continue
+        member  = world.rng.choice(world.members(guild))
+        added   = index % 2 == 0
+        payload = make_reaction(guild, channel, message_id, member, TRIGGER_EMOJI, added)
+        batch.append(timed(result, (cog.on_raw_reaction_add if added else cog.on_raw_reaction_remove)(payload)))
+        if len(batch) >= args.churn_concurrency:
+            await asyncio.gather(*batch)
+            batch = []
+    await asyncio.gather(*batch)
+    await settle(cog)
+    result.rest_calls = rest_snapshot(client) - before
+    return result
+
+async def run_verify(cog, client, world, args) -> Result:
+    '''verify_server_structure on every guild, as every command and thread creation does'''
+    result = Result("verify_server_structure")
+    before = rest_snapshot(client)
+    for _ in range(args.verify_rounds):
+        for guild in world.guilds:
+            await timed(result, cog.verify_server_structure(guild))
+    await settle(cog)
+    result.rest_calls = rest_snapshot(client) - before
+    return result
+
+async def run_archive(cog, client, world, args) -> Result:
+    '''Archive jobs on long threads; reports mirrored messages per second'''
+    result  = Result("archive_thread")
+    before  = rest_snapshot(client)
+    threads = [world.long_thread(cog, guild, args.archive_messages) for guild in world.guilds[:args.archive_threads]]
+
+    start = time.perf_counter()
+    for thread in threads:
+        await timed(result, cog.start_archive_job(thread).task)
+    await settle(cog)
+    elapsed = time.perf_counter() - start
+    result.rest_calls = rest_snapshot(client) - before
+    result.notes["messages_archived"]   = args.archive_messages * len(threads)
+    result.notes["messages_per_second"] = round(args.archive_messages * len(threads) / elapsed, 1) if elapsed else 0.0
+    return result
+
+async def run_contention(cog, client, world, args) -> Result:
+    '''Fresh 🧵 reactions in a guild that is busy archiving a long thread; their latency should not depend on the archive'''
+    result  = Result("threads during archive")
+    guild   = world.guilds[-1]
+    before  = rest_snapshot(client)
+    archive = cog.start_archive_job(world.long_thread(cog, guild, args.archive_messages)).task
+    await asyncio.sleep(0)
+    for channel, message in world.sources[guild.id][:args.contention_threads]:
+        await timed(result, cog.on_raw_reaction_add(make_reaction(guild, channel, message.id, world.rng.choice(world.members(guild)), TRIGGER_EMOJI)))
+        await asyncio.sleep(args.rest_latency_ms / 1000) # People don't all react in the same instant
+    del world.sources[guild.id][:args.contention_threads]
+    result.notes["archive_done_before_last_thread"] = archive.done()
+    await archive
+    await settle(cog)
+    result.rest_calls = rest_snapshot(client) - before
+    return result
+
+async def run_resume(cog, client, world, args) -> Result:
+    '''An archive job interrupted part way (as by a restart), then failing to delete its channel, and resumed both times'''
+    result = Result("archive resume")
+    guild  = world.guilds[0]
+    before = rest_snapshot(client)
+    thread = world.long_thread(cog, guild, args.archive_messages)
+    archive_channel = discord.utils.get(guild.text_channels, name="📓｜thread_archive")
+    posts_before    = len(archive_channel.messages)
+
+    # Small uploads split transcripts into several parts, so there is a checkpoint to stop at before the last one
+    filesize_limit        = guild.filesize_limit
+    guild.filesize_limit  = TRANSCRIPT_HEADROOM + args.resume_part_kb * 1024
+    job = cog.start_archive_job(thread)
+    while job.last_message_id is None and not job.task.done():
+        await asyncio.sleep(0)
+    job.task.cancel()
+    await asyncio.gather(job.task, return_exceptions=True)
+    result.notes["archived_before_restart"] = job.archived
+
+    # Once everything is mirrored, the delete fails once; the next resume should only retry the delete
+    delete = thread.delete
+    async def fail_once(reason : str = None):
+        thread.delete = delete
+        raise discord.HTTPException(FakeResponse(500), "Internal Server Error")
+    thread.delete = fail_once
+
+    start = time.perf_counter()
+    for attempt in range(2):
+        await cog.resume_archive_jobs()
+        resumed = cog.archive_jobs.get(thread.id)
+        if resumed is not None:
+            await timed(result, resumed.task)
+            result.notes["archived_after_resume"] = resumed.archived
+    guild.filesize_limit = filesize_limit
+    await settle(cog)
+    result.rest_calls = rest_snapshot(client) - before
+
+    # Every message should be mirrored once: one opening embed or summary, and no part uploaded twice
+    posts = archive_channel.messages[posts_before:]
+    parts = [post.content for post in posts if "transcript, part" in post.content]
+    result.notes["archive_headers"]    = sum(1 for post in posts for embed in post.embeds if embed.title == thread.name)
+    result.notes["duplicate_parts"]    = len(parts) - len(set(parts))
+    result.notes["thread_deleted"]     = client.get_channel(thread.id) is None
+    result.notes["checkpoint_cleared"] = (await cog.config.channel(thread).archive_checkpoint()) is None
+    result.notes["resume_seconds"]     = round(time.perf_counter() - start, 3)
+    return result
+
+async def run_capacity(cog, client, world, args) -> Result:
+    '''Fresh 🧵 reactions in a guild whose thread category is full and which is closing in on Discord's channel limit'''
+    result  = Result("threads near limits")
+    guild   = FakeGuild(client, make_snowflake(), "guild-crowded")
+    client.add_guild(guild)
+    members = [guild.add_member("member-" + str(index)) for index in range(args.members)]
+    await cog.config.guild(guild).set_raw("archive_format", value=args.archive_format)
+
+    # A full thread category, its idle threads oldest first, and plenty of other channels
+    category = guild.add_category("══════ ❖ THREADS ❖ ══════")
+    guild.add_text_channel("📓｜thread_archive", "This channel records conversations from old threads.", category)
+    started = datetime.utcnow() - timedelta(hours=CATEGORY_CHANNEL_LIMIT)
+    for index in range(CATEGORY_CHANNEL_LIMIT - 1):
+        thread = guild.add_text_channel("🧵｜thread_" + str(index), "[THREAD] " + str(make_snowflake()) + " By <@" + str(members[0].id) + ">: \n", category)
+        thread.add_message(members[0], "reply", started + timedelta(hours=index))
+    source_channels = [guild.add_text_channel("channel-" + str(index)) for index in range(args.crowded_channels)]
+    sources = [channel.add_message(world.rng.choice(members), "Something worth discussing") for channel in source_channels
+                                                                                           for _ in range(args.messages_per_channel)]
+    cog.index_guild(guild)
+    result.notes["channels_before"] = len(guild.channels)
+
+    before = rest_snapshot(client)
+    failures = 0
+    for message in sources[:args.crowded_threads]:
+        try:
+            await timed(result, cog.on_raw_reaction_add(make_reaction(guild, message.channel, message.id, world.rng.choice(members), TRIGGER_EMOJI)))
+        except discord.HTTPException:
+            failures += 1
+    await settle(cog)
+    result.rest_calls = rest_snapshot(client) - before
+    result.notes["failed_creations"]    = failures
+    result.notes["categories"]          = len(guild.categories)
+    result.notes["fullest_category"]    = max(len(category.channels) for category in guild.categories)
+    result.notes["channels_after"]      = len(guild.channels)
+    result.notes["threads_archived"]    = sum(1 for index in range(CATEGORY_CHANNEL_LIMIT - 1)
+                                              if discord.utils.get(category.channels, name="🧵｜thread_" + str(index)) is None)
+    return result
+
+async def run_recreate(cog, client, world, args) -> Result:
+    '''🧵 again on messages whose threads were archived or deleted; the source message should only be fetched once'''
+    result = Result("recreated threads")
+    picks  = []
+    for _ in range(args.recreate_threads):
+        guild = world.random_guild()
+        if world.sources[guild.id]:
+            picks.append((guild, *world.sources[guild.id].pop()))
+
+    before = rest_snapshot(client)
+    for round_index in range(args.recreate_rounds):
+        for guild, channel, message in picks:
+            await timed(result, cog.on_raw_reaction_add(make_reaction(guild, channel, message.id, world.rng.choice(world.members(guild)), TRIGGER_EMOJI)))
+        await settle(cog)
+        for guild, channel, message in picks:
+            thread = cog.find_thread(guild, message.id)
+            if thread is not None:
+                await thread.delete()
+    result.rest_calls = rest_snapshot(client) - before
+    result.notes["source_fetches"] = result.rest_calls["GET message"]
+    result.notes["threads_created"] = result.rest_calls["POST channels"]
+    return result
+
+SCENARIOS = {
+    "noise"   : run_noise,
+    "burst"   : run_burst,
+    "churn"   : run_churn,
+    "verify"  : run_verify,
+    "archive" : run_archive,
+    "contention" : run_contention,
+    "resume"  : run_resume,
+    "capacity" : run_capacity,
+    "recreate" : run_recreate,
+}
+
+async def run(args) -> list[Result]:
+    rng    = random.Random(args.seed)
+    client = FakeClient(rest_latency=args.rest_latency_ms / 1000)
+    world  = World(client, args, rng)
+
+    # The cog reads its settings through Config; swap in the in-memory stand-in before constructing it
+    threadweaver_module.Config = FakeConfig
+    cog = Threadweaver(client)
+    client.cogs.append(cog)
+    for guild in client.guilds:
+        await cog.config.guild(guild).set_raw("membership_debounce_seconds", value=args.debounce)
+        await cog.config.guild(guild).set_raw("archive_format", value=args.archive_format)
+    await cog.init_task
+    client.rest_calls.clear()
+
+    results = []
+    try:
+        for name in args.scenarios:
+            results.append(await SCENARIOS[name](cog, client, world, args))
+    finally:
+        cog.cog_unload()
+    return results
+
+def print_report(results : list[Result]):
+    header = "{:<26} {:>7} {:>9} {:>9} {:>9} {:>9} {:>8} {:>10}".format(
+        "scenario", "events", "p50 ms", "p90 ms", "p99 ms", "max ms", "REST", "REST/evt")
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        row = result.as_dict()
+        print("{scenario:<26} {events:>7} {p50_ms:>9.3f} {p90_ms:>9.3f} {p99_ms:>9.3f} {max_ms:>9.3f} {rest_calls:>8} {rest_per_event:>10.3f}".format(**row))
+    print()
+    for result in results:
+        row = result.as_dict()
+        extras = { key : value for key, value in row.items() if key in result.notes }
+        endpoints = ", ".join(endpoint + "=" + str(count) for endpoint, count in row["endpoints"].items()) or "none"
+        print(result.name + ": " + endpoints + ("  " + json.dumps(extras, ensure_ascii=False) if extras else ""))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--guilds",               type=int,   default=200)
+    parser.add_argument("--channels-per-guild",   type=int,   default=20)
+    parser.add_argument("--messages-per-channel", type=int,   default=5)
+    parser.add_argument("--members",              type=int,   default=60)
+    parser.add_argument("--threads-per-guild",    type=int,   default=5)
+    parser.add_argument("--noise",                type=int,   default=5000, help="non-trigger reactions to replay")
+    parser.add_argument("--bursts",               type=int,   default=50,   help="fresh messages that receive a 🧵 burst")
+    parser.add_argument("--burst-size",           type=int,   default=40,   help="simultaneous 🧵 reactions per burst")
+    parser.add_argument("--churn",                type=int,   default=2000, help="🧵 add/remove toggles on existing threads")
+    parser.add_argument("--churn-concurrency",    type=int,   default=20)
+    parser.add_argument("--verify-rounds",        type=int,   default=5)
+    parser.add_argument("--archive-threads",      type=int,   default=3)
+    parser.add_argument("--archive-messages",     type=int,   default=2000, help="messages in each archived thread")
+    parser.add_argument("--contention-threads",   type=int,   default=20,   help="threads created while an archive runs")
+    parser.add_argument("--resume-part-kb",       type=int,   default=16,   help="transcript part size while the resume scenario runs")
+    parser.add_argument("--crowded-channels",     type=int,   default=420,  help="other channels in the guild whose threads near its limits")
+    parser.add_argument("--crowded-threads",      type=int,   default=120,  help="threads created in that guild")
+    parser.add_argument("--recreate-threads",     type=int,   default=100,  help="messages whose thread is deleted and created again")
+    parser.add_argument("--recreate-rounds",      type=int,   default=5)
+    parser.add_argument("--archive-format",       default="embeds", choices=["embeds", "jsonl", "text"])
+    parser.add_argument("--debounce",             type=float, default=0.05, help="membership_debounce_seconds to use")
+    parser.add_argument("--rest-latency-ms",      type=float, default=0.0,  help="simulated round-trip of every REST call")
+    parser.add_argument("--seed",                 type=int,   default=1)
+    parser.add_argument("--scenarios",            nargs="+",  default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument("--json",                 help="also write the results to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    results = asyncio.run(run(args))
+    print_report(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump([result.as_dict() for result in results], file, indent=2, ensure_ascii=False)
+
+if __name__ == "__main__":
+    main()
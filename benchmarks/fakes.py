@@ -0,0 +1,498 @@
+'''
+Local stand-ins for the parts of discord.py and Red that Threadweaver touches, so its hot paths can be
+replayed offline.  Every method that would be a REST call on a real bot is counted by the owning FakeClient.
+'''
+from collections import Counter, namedtuple
+from datetime import datetime
+import asyncio
+import copy
+import itertools
+import discord
+
+SNOWFLAKE_EPOCH = datetime(2021, 1, 1)
+CATEGORY_CHANNEL_LIMIT = 50  # Discord refuses channels past these
+GUILD_CHANNEL_LIMIT    = 500
+snowflake_counter = itertools.count(1)
+
+# What discord.py keeps in GuildChannel._overwrites: the raw overwrites, whether or not their member is cached
+RawOverwrite = namedtuple("RawOverwrite", ("id", "allow", "deny", "type"))
+
+def make_snowflake(when : datetime = None) -> int:
+    '''A unique id whose embedded timestamp is `when` (now, by default), like Discord's own ids'''
+    return discord.utils.time_snowflake(when or datetime.utcnow()) + next(snowflake_counter) % 4096
+
+class FakeValue:
+    '''One Config value: awaiting it reads, .set() writes'''
+
+    def __init__(self, group, name : str):
+        self.group = group
+        self.name  = name
+
+    async def __call__(self):
+        return await self.group.get_raw(self.name)
+
+    async def set(self, value):
+        await self.group.set_raw(self.name, value=value)
+
+    async def clear(self):
+        await self.group.clear_raw(self.name)
+
+class FakeGroup:
+    '''The Config group of a single guild/channel/global scope, backed by a plain dict'''
+
+    def __init__(self, config, defaults : dict, data : dict):
+        self._config   = config
+        self._defaults = defaults
+        self._data     = data
+
+    def __getattr__(self, name : str) -> FakeValue:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return FakeValue(self, name)
+
+    async def get_raw(self, *path, default=...):
+        self._config.reads += 1
+        merged = copy.deepcopy(self._defaults)
+        merged.update(copy.deepcopy(self._data))
+        value = merged
+        try:
+            for key in path:
+                value = value[str(key)]
+        except KeyError:
+            if default is ...:
+                raise
+            return default
+        return value
+
+    async def set_raw(self, *path, value):
+        self._config.writes += 1
+        target = self._data
+        for key in path[:-1]:
+            target = target.setdefault(str(key), {})
+        target[str(path[-1])] = copy.deepcopy(value)
+
+    async def clear_raw(self, *path):
+        self._config.writes += 1
+        target = self._data
+        for key in path[:-1]:
+            target = target.get(str(key), {})
+        target.pop(str(path[-1]), None)
+
+    async def all(self) -> dict:
+        return await self.get_raw()
+
+    async def clear(self):
+        self._config.writes += 1
+        self._data.clear()
+
+class FakeConfig:
+    '''In-memory replacement for redbot.core.Config; counts reads and writes'''
+
+    def __init__(self):
+        self.defaults : dict[str, dict] = { "GLOBAL" : {}, "GUILD" : {}, "CHANNEL" : {} }
+        self.data     : dict[str, dict] = { "GLOBAL" : {}, "GUILD" : {}, "CHANNEL" : {} }
+        self.reads    : int = 0
+        self.writes   : int = 0
+
+    @classmethod
+    def get_conf(cls, cog_instance, identifier : int, **kwargs):
+        return cls()
+
+    def register_global(self, **defaults):
+        self.defaults["GLOBAL"].update(defaults)
+
+    def register_guild(self, **defaults):
+        self.defaults["GUILD"].update(defaults)
+
+    def register_channel(self, **defaults):
+        self.defaults["CHANNEL"].update(defaults)
+
+    def _group(self, scope : str, key) -> FakeGroup:
+        data = self.data[scope] if key is None else self.data[scope].setdefault(key, {})
+        return FakeGroup(self, self.defaults[scope], data)
+
+    def __getattr__(self, name : str) -> FakeValue:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return FakeValue(self._group("GLOBAL", None), name)
+
+    def guild(self, guild) -> FakeGroup:
+        return self._group("GUILD", guild.id)
+
+    def guild_from_id(self, guild_id : int) -> FakeGroup:
+        return self._group("GUILD", guild_id)
+
+    def channel(self, channel) -> FakeGroup:
+        return self._group("CHANNEL", channel.id)
+
+    def channel_from_id(self, channel_id : int) -> FakeGroup:
+        return self._group("CHANNEL", channel_id)
+
+    async def all_channels(self) -> dict:
+        self.reads += 1
+        return { channel_id : dict(copy.deepcopy(self.defaults["CHANNEL"]), **copy.deepcopy(data))
+                 for channel_id, data in self.data["CHANNEL"].items() if data }
+
+class FakeHTTP:
+    '''Stands in for discord.http.HTTPClient.request'''
+
+    def __init__(self, client):
+        self.client = client
+
+    async def request(self, route, **kwargs):
+        await self.client.rest(route.method + " " + route.path)
+        channel = self.client.get_channel(route.channel_id)
+        if channel is not None and route.path.endswith("/messages") and route.method == "POST":
+            payload = kwargs.get("json", {})
+            channel.add_message(self.client.user, payload.get("content") or "",
+                                embeds=[discord.Embed.from_dict(embed) for embed in payload.get("embeds", [])])
+
+    async def remove_reaction(self, channel_id : int, message_id : int, emoji : str, member_id : int):
+        await self.client.rest("DELETE reaction")
+
+class FakeClient:
+    '''The bot: owns the guilds, dispatches gateway events to the cog, and counts REST calls'''
+
+    def __init__(self, rest_latency : float = 0):
+        self.loop         = asyncio.get_event_loop()
+        self.rest_latency = rest_latency
+        self.rest_calls   : Counter = Counter()
+        self.guilds       : list[FakeGuild] = []
+        self.cogs         : list = []
+        self.user         = FakeMember(None, make_snowflake(), "Threadweaver")
+        self.http         = FakeHTTP(self)
+        self._guilds      : dict[int, FakeGuild] = {}
+
+    async def rest(self, endpoint : str):
+        self.rest_calls[endpoint] += 1
+        await asyncio.sleep(self.rest_latency)
+
+    def add_guild(self, guild):
+        self.guilds.append(guild)
+        self._guilds[guild.id] = guild
+
+    def get_guild(self, guild_id : int):
+        return self._guilds.get(guild_id)
+
+    def get_channel(self, channel_id : int):
+        for guild in self.guilds:
+            channel = guild.get_channel(channel_id)
+            if channel is not None:
+                return channel
+        return None
+
+    def get_all_channels(self):
+        for guild in self.guilds:
+            yield from guild.channels
+
+    def dispatch(self, event : str, *args):
+        for cog in self.cogs:
+            listener = getattr(cog, "on_" + event, None)
+            if listener is not None:
+                self.loop.create_task(listener(*args))
+
+    async def wait_until_ready(self):
+        return
+
+    async def get_valid_prefixes(self, guild=None) -> list[str]:
+        return ["!"]
+
+class FakeRole:
+    def __init__(self, guild, role_id : int, name : str, position : int):
+        self.guild    = guild
+        self.id       = role_id
+        self.name     = name
+        self.position = position
+
+    def __str__(self):
+        return self.name
+
+class FakeMember:
+    def __init__(self, guild, member_id : int, name : str):
+        self.guild        = guild
+        self.id           = member_id
+        self.name         = name
+        self.display_name = name
+        self.avatar_url   = "https://cdn.discordapp.com/embed/avatars/0.png"
+        self.mention      = "<@" + str(member_id) + ">"
+        self.roles        = [guild.default_role] if guild is not None else []
+        self.bot          = False
+
+    def __str__(self):
+        return self.name + "#0001"
+
+class FakeAttachment:
+    def __init__(self, filename : str, size : int):
+        self.filename = filename
+        self.size     = size
+        self.url      = "https://cdn.discordapp.com/attachments/0/0/" + filename
+
+class FakeMessage:
+    def __init__(self, channel, author, content : str, created_at : datetime = None, embeds : list = None):
+        self.created_at  = created_at or datetime.utcnow()
+        self.id          = make_snowflake(self.created_at)
+        self.channel     = channel
+        self.guild       = channel.guild
+        self.author      = author
+        self.content     = content
+        self.edited_at   = None
+        self.attachments = []
+        self.embeds      = embeds or []
+        self.jump_url    = "https://discord.com/channels/" + str(self.guild.id) + "/" + str(channel.id) + "/" + str(self.id)
+
+    async def remove_reaction(self, emoji, member):
+        await self.guild.client.rest("DELETE reaction")
+
+    async def delete(self):
+        await self.guild.client.rest("DELETE message")
+
+    async def edit(self, **fields):
+        await self.guild.client.rest("PATCH message")
+
+class FakeCategory:
+    def __init__(self, guild, channel_id : int, name : str, position : int):
+        self.guild    = guild
+        self.id       = channel_id
+        self.name     = name
+        self.position = position
+        self.channels : list[FakeTextChannel] = []
+
+    @property
+    def text_channels(self):
+        return self.channels
+
+    @property
+    def category_id(self):
+        return None
+
+    def __str__(self):
+        return self.name
+
+    async def delete(self, reason : str = None):
+        await self.guild.client.rest("DELETE channel")
+        self.guild.remove_channel(self)
+
+class FakeHistory:
+    '''Async iterator over a channel's messages; one REST call per page of 100, like channel.history()'''
+
+    def __init__(self, channel, limit : int, oldest_first : bool, after):
+        messages = list(channel.messages) if oldest_first else list(reversed(channel.messages))
+        if after is not None:
+            messages = [message for message in messages if message.id > after.id]
+        self.channel  = channel
+        self.messages = messages if limit is None else messages[:limit]
+        self.index    = 0
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.index >= len(self.messages):
+            raise StopAsyncIteration
+        if self.index % 100 == 0:
+            await self.channel.guild.client.rest("GET messages")
+        self.index += 1
+        return self.messages[self.index - 1]
+
+    async def flatten(self) -> list:
+        return [message async for message in self]
+
+class FakeTextChannel:
+    def __init__(self, guild, channel_id : int, name : str, topic : str = None, category : FakeCategory = None,
+                 overwrites : dict = None, position : int = 0):
+        self.guild      = guild
+        self.id         = channel_id
+        self.name       = name
+        self.topic      = topic
+        self.category   = category
+        self.overwrites = dict(overwrites or {})
+        self.position   = position
+        self.created_at = discord.utils.snowflake_time(channel_id)
+        self.messages   : list[FakeMessage] = []
+        self.mention    = "<#" + str(channel_id) + ">"
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def category_id(self):
+        return self.category.id if self.category is not None else None
+
+    @property
+    def last_message_id(self):
+        return self.messages[-1].id if self.messages else None
+
+    @property
+    def _overwrites(self) -> list[RawOverwrite]:
+        raw = []
+        for target, overwrite in self.overwrites.items():
+            allow, deny = overwrite.pair()
+            raw.append(RawOverwrite(target.id, allow.value, deny.value, "role" if isinstance(target, FakeRole) else "member"))
+        return raw
+
+    def add_message(self, author, content : str, created_at : datetime = None, embeds : list = None) -> FakeMessage:
+        '''Puts a message into the channel without any REST call (e.g. one sent by another user)'''
+        message = FakeMessage(self, author, content, created_at, embeds)
+        self.messages.append(message)
+        return message
+
+    async def send(self, content : str = None, *, embed=None, file=None, files=None, allowed_mentions=None, **kwargs):
+        await self.guild.client.rest("POST messages")
+        message = self.add_message(self.guild.client.user, content or "", embeds=[embed] if embed else [])
+        self.guild.client.dispatch("message", message)
+        return message
+
+    async def fetch_message(self, message_id : int) -> FakeMessage:
+        await self.guild.client.rest("GET message")
+        for message in self.messages:
+            if message.id == message_id:
+                return message
+        raise discord.NotFound(FakeResponse(404), "Unknown Message")
+
+    def get_partial_message(self, message_id : int):
+        return FakePartialMessage(self, message_id)
+
+    def history(self, limit : int = 100, oldest_first : bool = None, after=None, **kwargs) -> FakeHistory:
+        return FakeHistory(self, limit, bool(oldest_first), after)
+
+    async def set_permissions(self, target, *, overwrite=..., reason : str = None, **permissions):
+        await self.guild.client.rest("PUT permissions")
+        if overwrite is None:
+            self.overwrites.pop(target, None)
+        else:
+            self.overwrites[target] = overwrite if overwrite is not ... else discord.PermissionOverwrite(**permissions)
+
+    async def edit(self, *, reason : str = None, **fields):
+        await self.guild.client.rest("PATCH channel")
+        before = copy.copy(self)
+        for field, value in fields.items():
+            if field == "category":
+                self.guild.move_channel(self, value)
+            else:
+                setattr(self, field, value)
+        self.guild.client.dispatch("guild_channel_update", before, self)
+
+    async def delete(self, reason : str = None):
+        await self.guild.client.rest("DELETE channel")
+        self.guild.remove_channel(self)
+
+class FakePartialMessage:
+    def __init__(self, channel, message_id : int):
+        self.channel = channel
+        self.id      = message_id
+
+    async def remove_reaction(self, emoji, member):
+        await self.channel.guild.client.rest("DELETE reaction")
+
+class FakeResponse:
+    '''Just enough of an aiohttp response to build discord.HTTPException subclasses'''
+
+    def __init__(self, status : int):
+        self.status = status
+        self.reason = "Fake"
+
+class FakeGuild:
+    def __init__(self, client : FakeClient, guild_id : int, name : str):
+        self.client         = client
+        self.id             = guild_id
+        self.name           = name
+        self.filesize_limit = 8 * 1024 * 1024
+        self.icon_url       = ""
+        self.default_role   = FakeRole(self, guild_id, "@everyone", 0)
+        self.roles          = [self.default_role]
+        self._channels      : dict[int, object] = {}
+        self._members       : dict[int, FakeMember] = {}
+        self.me             = self.add_member("Threadweaver", client.user.id)
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def channels(self) -> list:
+        return list(self._channels.values())
+
+    @property
+    def text_channels(self) -> list[FakeTextChannel]:
+        return [channel for channel in self._channels.values() if isinstance(channel, FakeTextChannel)]
+
+    @property
+    def categories(self) -> list[FakeCategory]:
+        return [channel for channel in self._channels.values() if isinstance(channel, FakeCategory)]
+
+    @property
+    def members(self) -> list[FakeMember]:
+        return list(self._members.values())
+
+    def get_channel(self, channel_id : int):
+        return self._channels.get(channel_id)
+
+    def get_role(self, role_id : int) -> FakeRole:
+        return discord.utils.get(self.roles, id=role_id)
+
+    def get_member(self, member_id : int) -> FakeMember:
+        return self._members.get(member_id)
+
+    def add_member(self, name : str, member_id : int = None) -> FakeMember:
+        member = FakeMember(self, member_id or make_snowflake(), name)
+        self._members[member.id] = member
+        return member
+
+    def add_text_channel(self, name : str, topic : str = None, category : FakeCategory = None) -> FakeTextChannel:
+        '''Creates a channel without any REST call or gateway event, for setting up a scenario'''
+        channel = FakeTextChannel(self, make_snowflake(), name, topic, category)
+        self._channels[channel.id] = channel
+        if category is not None:
+            category.channels.append(channel)
+        return channel
+
+    def add_category(self, name : str) -> FakeCategory:
+        category = FakeCategory(self, make_snowflake(), name, len(self._channels))
+        self._channels[category.id] = category
+        return category
+
+    def move_channel(self, channel : FakeTextChannel, category : FakeCategory):
+        if channel.category is not None:
+            channel.category.channels.remove(channel)
+        channel.category = category
+        if category is not None:
+            category.channels.append(channel)
+
+    def remove_channel(self, channel):
+        if self._channels.pop(channel.id, None) is None:
+            return
+        if getattr(channel, "category", None) is not None:
+            channel.category.channels.remove(channel)
+        self.client.dispatch("guild_channel_delete", channel)
+
+    def check_capacity(self, category : FakeCategory = None):
+        '''Refuses new channels the way Discord does once a guild or category is full'''
+        if len(self._channels) >= GUILD_CHANNEL_LIMIT:
+            raise discord.HTTPException(FakeResponse(400), "Maximum number of guild channels reached (" + str(GUILD_CHANNEL_LIMIT) + ")")
+        if category is not None and len(category.channels) >= CATEGORY_CHANNEL_LIMIT:
+            raise discord.HTTPException(FakeResponse(400), "Maximum number of channels in category reached (" + str(CATEGORY_CHANNEL_LIMIT) + ")")
+
+    async def create_category(self, name : str, *, reason : str = None, **kwargs) -> FakeCategory:
+        await self.client.rest("POST channels")
+        self.check_capacity()
+        category = self.add_category(name)
+        self.client.dispatch("guild_channel_create", category)
+        return category
+
+    async def create_text_channel(self, name : str, *, overwrites : dict = None, topic : str = None, category=None,
+                                  position : int = 0, reason : str = None, **kwargs) -> FakeTextChannel:
+        await self.client.rest("POST channels")
+        self.check_capacity(category)
+        channel = FakeTextChannel(self, make_snowflake(), name, topic, None, overwrites, position)
+        self._channels[channel.id] = channel
+        self.move_channel(channel, category)
+        self.client.dispatch("guild_channel_create", channel)
+        return channel
+
+def make_reaction(guild : FakeGuild, channel : FakeTextChannel, message_id : int, member : FakeMember,
+                  emoji : str, added : bool = True) -> discord.RawReactionActionEvent:
+    '''Builds the same payload the gateway would hand to on_raw_reaction_add/remove'''
+    data = { "message_id" : message_id, "channel_id" : channel.id, "user_id" : member.id, "guild_id" : guild.id }
+    payload = discord.RawReactionActionEvent(data, discord.PartialEmoji(name=emoji), "REACTION_ADD" if added else "REACTION_REMOVE")
+    if added:
+        payload.member = member
+    return payload
@@ -1,21 +1,621 @@
 from asyncio.tasks import sleep
+import asyncio
+import contextlib
+import collections
+import contextvars
+import functools
+import heapq
+import time
 from redbot.core import commands, Config
 import discord
 from   discord import Embed, Member, Message, RawReactionActionEvent, Client, Guild, TextChannel, CategoryChannel, Role, AllowedMentions
 from   discord.ext.commands import Cog
+from   discord.http import Route
+from collections import Counter
 from datetime import datetime, timedelta
+import gzip
+import io
+import json
 import re
 import logging
 logger = logging.getLogger("red.Threadweaver.threadweaver")
 
+# Matches "[THREAD] <source message id> By <@owner id>" at the start of a thread's topic.
+# Older threads only stored the last 4 digits of the source message id.
+THREAD_TOPIC_PATTERN = re.compile(r"^\[THREAD\] ([0-9]+) By <@!?([0-9]+)>")
+
+# How often (at most) each guild's idle threads are checked against prune_interval_days
+PRUNE_CHECK_SECONDS = 3600
+
+# Discord's limits on the embeds of a single message, used when mirroring threads to the archive
+EMBED_DESCRIPTION_LIMIT = 2000
+EMBEDS_PER_MESSAGE      = 10
+EMBED_TOTAL_LIMIT       = 6000
+
+# Values of the archive_format setting that archive threads as a gzip'd transcript file instead of embeds
+TRANSCRIPT_FORMATS   = { "jsonl" : ".jsonl.gz", "text" : ".txt.gz" }
+TRANSCRIPT_HEADROOM  = 64 * 1024 # Bytes left free under the upload limit for the gzip trailer and multipart overhead
+ARCHIVE_FORMATS      = ("embeds", *TRANSCRIPT_FORMATS)
+
+# Every Discord write goes through a per-guild queue; lower numbers are dispatched first
+PRIORITY_INTERACTIVE = 0 # Creating threads and letting people in
+PRIORITY_MESSAGE     = 1 # Opening posts, welcome and farewell messages
+PRIORITY_BACKGROUND  = 2 # Archiving and pruning
+PRIORITY_BULK        = 3 # The deletes of bulk commands
+SCHEDULER_WORKERS            = 3  # Concurrent interactive and message writes per guild
+SCHEDULER_BACKGROUND_WORKERS = 1  # Extra workers for background writes, so archives drain one write at a time; bulk deletes get BULK_CONCURRENCY
+RATE_LIMIT_COOLDOWN          = 5  # Seconds background and bulk work is held back after Discord still answers 429 despite the client's retries
+
+# How long the overwrites we last sent stand in for a thread's cached ones, in case the gateway never echoes them back
+OVERWRITE_ECHO_SECONDS = 30
+
+# Discord's channel limits; threads spill into overflow categories, and idle ones are archived early as a guild nears its limit
+CATEGORY_CHANNEL_LIMIT = 50
+GUILD_CHANNEL_LIMIT    = 500 # Categories count towards this too
+
+# Source messages are kept this long (and this many per bot) so repeated 🧵 toggles don't fetch them again
+SOURCE_CACHE_SIZE    = 4096
+SOURCE_CACHE_SECONDS = 900
+
+# Bulk commands work on this many threads at once, and refresh their progress message at most this often
+BULK_CONCURRENCY      = 4
+BULK_PROGRESS_SECONDS = 2
+
+# How many writes of each deferred priority class a guild may run at once, on workers of their own
+DEFERRED_WORKERS = { PRIORITY_BACKGROUND : SCHEDULER_BACKGROUND_WORKERS, PRIORITY_BULK : BULK_CONCURRENCY }
+
+class ThreadRecord:
+    '''Registry entry tying a thread channel to the message it was created from and its owner'''
+    __slots__ = ("guild_id", "channel_id", "source_key", "owner_id")
+
+    def __init__(self, guild_id : int, channel_id : int, source_key : str, owner_id : int):
+        self.guild_id   : int = guild_id
+        self.channel_id : int = channel_id
+        self.source_key : str = source_key # The full source message id, or its last 4 digits for legacy threads
+        self.owner_id   : int = owner_id
+
+class LatencyHistogram:
+    '''Fixed-bucket latency histogram, cheap enough to update on every event'''
+    BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, float("inf"))
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts : list[int] = [0] * len(self.BUCKETS_MS)
+        self.count  : int       = 0
+        self.total  : float     = 0.0 # seconds
+        self.max    : float     = 0.0 # seconds
+
+    def record(self, seconds : float):
+        milliseconds = seconds * 1000
+        for index, bound in enumerate(self.BUCKETS_MS):
+            if milliseconds <= bound:
+                self.counts[index] += 1
+                break
+        self.count += 1
+        self.total += seconds
+        self.max    = max(self.max, seconds)
+
+    def percentile(self, fraction : float) -> float:
+        '''Upper bound (in milliseconds) of the bucket holding the given fraction of samples'''
+        target, seen = fraction * self.count, 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target and seen > 0:
+                return min(self.BUCKETS_MS[index], self.max * 1000)
+        return 0.0
+
+# The instrumented path currently running in this task; REST calls are attributed to it
+current_path : contextvars.ContextVar = contextvars.ContextVar("threadweaver_path", default="other")
+
+class ThreadweaverStats:
+    '''Counters for the cog's hot paths: latency, REST calls, and archive throughput'''
+
+    def __init__(self):
+        self.started         : datetime = datetime.utcnow()
+        self.latency         : dict[str, LatencyHistogram] = {} # path -> handler latency
+        self.rest_calls      : Counter = Counter()              # path -> REST calls issued while it was innermost
+        self.guild_rest      : Counter = Counter()              # guild id -> REST calls
+        self.archived        : int     = 0                      # messages mirrored to the archive
+        self.archive_seconds : float   = 0.0
+        self.evicted         : int     = 0                      # threads archived early to stay under Discord's channel limit
+
+    @contextlib.contextmanager
+    def measure(self, path : str):
+        token = current_path.set(path)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.latency.setdefault(path, LatencyHistogram()).record(time.perf_counter() - start)
+            current_path.reset(token)
+
+    def rest(self, guild : Guild, calls : int = 1):
+        '''Counts REST calls about to be made on behalf of a guild'''
+        self.rest_calls[current_path.get()] += calls
+        if guild is not None:
+            self.guild_rest[guild.id] += calls
+
+    def record_archive(self, messages : int, seconds : float):
+        self.archived        += messages
+        self.archive_seconds += seconds
+
+    def snapshot(self) -> dict:
+        '''Everything as plain data, for the structured log line'''
+        return {
+            "uptime_s"   : round((datetime.utcnow() - self.started).total_seconds()),
+            "paths"      : { path : { "calls"  : histogram.count,
+                                      "p50_ms" : round(histogram.percentile(0.50), 1),
+                                      "p99_ms" : round(histogram.percentile(0.99), 1),
+                                      "max_ms" : round(histogram.max * 1000, 1),
+                                      "rest"   : self.rest_calls[path] }
+                             for path, histogram in self.latency.items() },
+            "rest_total" : sum(self.rest_calls.values()),
+            "top_guilds" : { str(guild_id) : calls for guild_id, calls in self.guild_rest.most_common(5) },
+            "archived"   : self.archived,
+            "archive_msgs_per_s" : round(self.archived / self.archive_seconds, 1) if self.archive_seconds else 0.0,
+            "evicted"    : self.evicted
+        }
+
+def instrumented(path : str):
+    '''Records a coroutine method's latency, and the REST calls it makes, under `path` in self.stats'''
+    def decorator(function):
+        @functools.wraps(function)
+        async def wrapper(self, *args, **kwargs):
+            with self.stats.measure(path):
+                return await function(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+class SourceMessage:
+    '''The parts of a thread's source message that thread creation uses, without holding on to the whole Message'''
+    __slots__ = ("id", "author_id", "author_name", "author_display_name", "author_avatar_url", "content", "jump_url")
+
+    def __init__(self, message : Message):
+        self.id                  : int = message.id
+        self.author_id           : int = message.author.id
+        self.author_name         : str = message.author.name
+        self.author_display_name : str = message.author.display_name
+        self.author_avatar_url   : str = str(message.author.avatar_url)
+        self.content             : str = message.content
+        self.jump_url            : str = message.jump_url
+
+class LRUCache:
+    '''A bounded mapping that drops its least recently used entries, and any older than max_age seconds'''
+    __slots__ = ("entries", "max_size", "max_age", "hits", "misses")
+
+    def __init__(self, max_size : int, max_age : float):
+        self.entries  : collections.OrderedDict = collections.OrderedDict() # key -> (time stored, value), least recently used first
+        self.max_size : int   = max_size
+        self.max_age  : float = max_age
+        self.hits     : int   = 0
+        self.misses   : int   = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None or time.monotonic() - entry[0] > self.max_age:
+            self.entries.pop(key, None)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, value):
+        self.entries[key] = (time.monotonic(), value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def pop(self, key):
+        self.entries.pop(key, None)
+
+class ArchiveJob:
+    '''A thread being archived in the background; its progress is also checkpointed in Config'''
+    __slots__ = ("channel_id", "task", "loaded", "last_message_id", "archived", "parts", "resumed", "error")
+
+    def __init__(self, channel_id : int):
+        self.channel_id      : int          = channel_id
+        self.task            : asyncio.Task = None
+        self.loaded          : asyncio.Event = asyncio.Event() # Set once the checkpoint has been read, so status() is accurate
+        self.last_message_id : int          = None # The last message already mirrored to the archive
+        self.archived        : int          = 0    # Messages mirrored so far, including before a restart
+        self.parts           : int          = 0    # Transcript files uploaded so far
+        self.resumed         : bool         = False
+        self.error           : Exception    = None
+
+    def load(self, checkpoint : dict):
+        self.last_message_id = checkpoint["last_message_id"]
+        self.archived        = checkpoint["archived"]
+        self.parts           = checkpoint["parts"]
+        self.resumed         = self.last_message_id is not None
+
+    def checkpoint(self) -> dict:
+        return { "last_message_id" : self.last_message_id, "archived" : self.archived, "parts" : self.parts }
+
+    def status(self) -> str:
+        return ("Resumed archiving" if self.resumed else "Archiving") + " this thread in the background; `" + str(self.archived) + \
+               "` messages mirrored so far.  The channel is deleted once it is done."
+
+class GuildStructure:
+    '''The categories and archive channel Threadweaver uses in one guild, plus how full they are; re-checked against the guild's cache on use'''
+    __slots__ = ("category_ids", "archive_channel_id", "category_channels", "channel_ids", "reserved")
+
+    def __init__(self):
+        self.category_ids       : list[int] = []   # The thread category first, then its overflow categories
+        self.archive_channel_id : int       = None
+        self.category_channels  : dict[int, set[int]] = {} # category id -> ids of the channels in it
+        self.channel_ids        : set[int]  = set()        # Every channel in the guild, categories included
+        self.reserved           : dict[int, int] = {}      # category id -> threads being created in it right now
+
+    def category(self, guild : Guild) -> CategoryChannel:
+        '''The main thread category, which also holds the archive channel'''
+        return guild.get_channel(self.category_ids[0]) if len(self.category_ids) > 0 else None
+
+    def categories(self, guild : Guild) -> list[CategoryChannel]:
+        '''The thread category and its overflow categories that still exist, in order'''
+        return [category for category in map(guild.get_channel, self.category_ids) if category is not None]
+
+    def archive_channel(self, guild : Guild) -> TextChannel:
+        return guild.get_channel(self.archive_channel_id) if self.archive_channel_id is not None else None
+
+    def is_intact(self, guild : Guild) -> bool:
+        '''False if either channel is unknown or has been deleted by the mods'''
+        return self.category(guild) is not None and self.archive_channel(guild) is not None
+
+    def index(self, guild : Guild, category_name : str):
+        '''Finds the thread category's overflow categories ("<name> 2", "<name> 3", ...) and counts the channels in each'''
+        overflow : dict[int, int] = {}
+        for category in guild.categories:
+            suffix : str = str(category)[len(category_name) + 1:]
+            if str(category).startswith(category_name + " ") and suffix.isdigit() and category.id not in self.category_ids[:1]:
+                overflow[int(suffix)] = category.id
+        self.category_ids      = self.category_ids[:1] + [overflow[number] for number in sorted(overflow)]
+        self.channel_ids       = { channel.id for channel in guild.channels }
+        self.category_channels = { category_id : set() for category_id in self.category_ids }
+        for channel in guild.channels:
+            self.add_channel(channel)
+
+    def add_category(self, category : CategoryChannel):
+        if category.id not in self.category_channels:
+            self.category_ids.append(category.id)
+            self.category_channels[category.id] = set()
+        self.add_channel(category)
+
+    def add_channel(self, channel):
+        '''Counts a channel; adding the same one twice (once from our own request, once from the gateway) is harmless'''
+        self.channel_ids.add(channel.id)
+        if channel.category_id in self.category_channels:
+            self.category_channels[channel.category_id].add(channel.id)
+
+    def remove_channel(self, channel):
+        self.channel_ids.discard(channel.id)
+        for channel_ids in self.category_channels.values():
+            channel_ids.discard(channel.id)
+
+    def category_load(self, category_id : int) -> int:
+        '''Channels in a category, counting the threads that are being created in it'''
+        return len(self.category_channels.get(category_id, ())) + self.reserved.get(category_id, 0)
+
+    def guild_load(self) -> int:
+        '''Channels in the guild, counting the threads that are being created'''
+        return len(self.channel_ids) + sum(self.reserved.values())
+
+    def reserve(self, category_id : int):
+        self.reserved[category_id] = self.reserved.get(category_id, 0) + 1
+
+    def release(self, category_id : int):
+        self.reserved[category_id] -= 1
+        if self.reserved[category_id] == 0:
+            del self.reserved[category_id]
+
+class KeyedLock:
+    '''Hands out one asyncio.Lock per key, forgetting it once nobody holds or awaits it'''
+
+    def __init__(self):
+        self.locks : dict = {} # key -> [lock, number of holders and waiters]
+
+    @contextlib.asynccontextmanager
+    async def __call__(self, key):
+        entry = self.locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.locks[key]
+
+class MembershipBatch:
+    '''Joins and leaves of one thread that are waiting to be applied together'''
+    __slots__ = ("changes", "before", "task")
+
+    def __init__(self):
+        self.changes : dict[int, bool] = {} # member id -> True if they joined, False if they left; only members whose state changed
+        self.before  : dict[int, bool] = {} # member id -> whether they were in the thread when this window opened
+        self.task    : asyncio.Task    = None
+
+class GuildQueue:
+    '''Pending writes of one guild, one deque per priority class'''
+    __slots__ = ("pending", "workers", "running", "deferred_paused_until", "wakeup")
+
+    def __init__(self):
+        self.pending               : list[collections.deque] = [collections.deque() for _ in range(PRIORITY_BULK + 1)]
+        self.workers               : set[asyncio.Task] = set()
+        self.running               : list[int] = [0] * (PRIORITY_BULK + 1) # Writes in flight, per priority class
+        self.deferred_paused_until : float = 0.0
+        self.wakeup                : asyncio.TimerHandle = None # Restarts deferred work once a 429 cooldown is over
+
+    def __len__(self):
+        return sum(len(pending) for pending in self.pending)
+
+    def busy_deferred(self) -> int:
+        return sum(self.running[priority] for priority in DEFERRED_WORKERS)
+
+class ActionScheduler:
+    '''
+    Runs each guild's Discord writes through a small pool of workers, highest priority first.
+    Background and bulk writes run on workers of their own, capped per class by DEFERRED_WORKERS, so a large archive,
+    prune or bulk delete drains steadily without ever making a 🧵 reaction wait behind it.  Workers only exist while
+    there is work queued.
+    '''
+
+    def __init__(self, loop, stats : ThreadweaverStats):
+        self.loop   = loop
+        self.stats  : ThreadweaverStats   = stats
+        self.queues : dict[int, GuildQueue] = {}
+
+    async def run(self, guild : Guild, priority : int, function, *args, **kwargs):
+        '''Queues function(*args, **kwargs) (a single Discord API call) and waits for its result'''
+        self.stats.rest(guild)
+        queue  : GuildQueue     = self.queues.setdefault(guild.id, GuildQueue())
+        future : asyncio.Future = self.loop.create_future()
+        queue.pending[priority].append((future, function, args, kwargs))
+        self.spawn(guild.id, queue)
+        return await future
+
+    def spawn(self, guild_id : int, queue : GuildQueue):
+        '''Starts another worker unless SCHEDULER_WORKERS are already free of deferred work'''
+        if len(queue.workers) - queue.busy_deferred() < SCHEDULER_WORKERS:
+            worker = self.loop.create_task(self.work(guild_id, queue))
+            queue.workers.add(worker)
+
+    def wake(self, guild_id : int, queue : GuildQueue):
+        queue.wakeup = None
+        if self.queues.get(guild_id) is queue and len(queue) > 0:
+            self.spawn(guild_id, queue)
+
+    def take(self, queue : GuildQueue):
+        '''The next action a worker may start, or None if everything left has to wait'''
+        for priority, pending in enumerate(queue.pending):
+            if not pending:
+                continue
+            if priority in DEFERRED_WORKERS and (queue.running[priority] >= DEFERRED_WORKERS[priority] or
+                                                 queue.deferred_paused_until > self.loop.time()):
+                continue
+            return priority, pending.popleft()
+        return None
+
+    async def work(self, guild_id : int, queue : GuildQueue):
+        try:
+            while True:
+                taken = self.take(queue)
+                if taken is None:
+                    # Rather than a worker sleeping out a cooldown (and counting against the pool), one timer restarts the backlog
+                    if queue.deferred_paused_until > self.loop.time() and queue.wakeup is None and \
+                       any(queue.pending[priority] for priority in DEFERRED_WORKERS):
+                        queue.wakeup = self.loop.call_at(queue.deferred_paused_until, self.wake, guild_id, queue)
+                    return
+                priority, (future, function, args, kwargs) = taken
+                if future.cancelled(): # The caller went away while this was queued
+                    continue
+
+                queue.running[priority] += 1
+                if priority in DEFERRED_WORKERS and len(queue) > 0:
+                    self.spawn(guild_id, queue) # This worker no longer counts towards SCHEDULER_WORKERS; let another take its place
+                try:
+                    result = await function(*args, **kwargs)
+                    if not future.cancelled():
+                        future.set_result(result)
+                except asyncio.CancelledError:
+                    future.cancel()
+                    raise
+                except Exception as error:
+                    if isinstance(error, discord.HTTPException) and error.status == 429:
+                        queue.deferred_paused_until = self.loop.time() + RATE_LIMIT_COOLDOWN
+                        logger.warning(msg="[THREADWEAVER] Still rate limited after retrying; holding back background work in guild "+str(guild_id))
+                    if not future.cancelled():
+                        future.set_exception(error)
+                finally:
+                    queue.running[priority] -= 1
+        finally:
+            queue.workers.discard(asyncio.current_task())
+            if len(queue.workers) == 0 and len(queue) == 0 and self.queues.get(guild_id) is queue:
+                del self.queues[guild_id]
+
+    def depth(self) -> int:
+        return sum(len(queue) for queue in self.queues.values())
+
+    def cancel(self):
+        for queue in self.queues.values():
+            if queue.wakeup is not None:
+                queue.wakeup.cancel()
+            for worker in list(queue.workers):
+                worker.cancel()
+            for pending in queue.pending:
+                for future, _, _, _ in pending:
+                    future.cancel()
+
+class ArchiveBatcher:
+    '''Packs archived lines into embeds, and embeds into as few messages as Discord's size limits allow'''
+
+    def __init__(self, send_embeds, title : str):
+        self.send_embeds    = send_embeds # Coroutine function that posts embeds as one message: (embeds, last message id, message count)
+        self.title    : str = title
+        self.lines    : str = ""
+        self.embeds   : list[Embed] = []
+        self.size     : int = 0 # Characters across self.embeds, as counted towards EMBED_TOTAL_LIMIT
+        self.messages : int = 0 # Messages posted so far
+        self.lines_last_id  : int = None # Latest archived message in self.lines, and how many messages it holds
+        self.lines_count    : int = 0
+        self.embeds_last_id : int = None # Likewise for self.embeds
+        self.embeds_count   : int = 0
+
+    async def add(self, line : str, message_id : int):
+        # Lines that can't fit in any embed are split across several
+        while len(line) > EMBED_DESCRIPTION_LIMIT:
+            await self.add_text(line[:EMBED_DESCRIPTION_LIMIT])
+            line = line[EMBED_DESCRIPTION_LIMIT:]
+        await self.add_text(line)
+        self.lines_last_id  = message_id
+        self.lines_count   += 1
+
+    async def add_text(self, text : str):
+        # If the text buffer is above the description limit, cut off a new embed
+        if len(self.lines) + len(text) > EMBED_DESCRIPTION_LIMIT:
+            await self.cut_embed()
+        self.lines += text
+
+    async def cut_embed(self):
+        if len(self.lines) == 0:
+            return
+        title : str = self.title if self.messages == 0 and len(self.embeds) == 0 else None
+        size  : int = len(self.lines) + (len(title) if title else 0)
+        if len(self.embeds) >= EMBEDS_PER_MESSAGE or self.size + size > EMBED_TOTAL_LIMIT:
+            await self.flush()
+        self.embeds.append(discord.Embed(title=title, description=self.lines, color=0xff4500))
+        self.size          += size
+        self.lines          = ""
+        self.embeds_last_id = self.lines_last_id or self.embeds_last_id
+        self.embeds_count  += self.lines_count
+        self.lines_count    = 0
+
+    async def flush(self):
+        if len(self.embeds) == 0:
+            return
+        await self.send_embeds(self.embeds, self.embeds_last_id, self.embeds_count)
+        self.messages    += 1
+        self.embeds       = []
+        self.size         = 0
+        self.embeds_count = 0
+
+    async def close(self):
+        '''Posts everything that is still buffered'''
+        await self.cut_embed()
+        await self.flush()
+
+class TranscriptWriter:
+    '''Streams messages into gzip'd transcript parts, starting a new part only when the upload limit is reached'''
+
+    def __init__(self, send_part, name : str, archive_format : str, size_limit : int, parts : int = 0, message_count : int = 0):
+        self.send_part           = send_part # Coroutine function that uploads a full part: (discord.File, part number, last message id, message count)
+        self.name          : str = name
+        self.format        : str = archive_format
+        self.size_limit    : int = size_limit - TRANSCRIPT_HEADROOM
+        self.parts         : int = parts         # Non-zero when resuming an interrupted archive
+        self.message_count : int = message_count
+        self.last_id       : int = None
+        self.authors       : set[int] = set()
+        self.first_time    : datetime = None
+        self.last_time     : datetime = None
+        self.start_part()
+
+    def start_part(self):
+        self.buffer    : io.BytesIO    = io.BytesIO()
+        self.gzip      : gzip.GzipFile = gzip.GzipFile(fileobj=self.buffer, mode="wb")
+        self.unflushed : int           = 0 # Uncompressed bytes written since the compressor was last flushed
+        self.written   : int           = 0 # Records in the current part
+
+    def format_message(self, message : Message) -> str:
+        attachments = [{ "filename" : attachment.filename, "url" : attachment.url, "size" : attachment.size }
+                       for attachment in message.attachments]
+        if self.format == "jsonl":
+            return json.dumps({
+                "id"          : message.id,
+                "author_id"   : message.author.id,
+                "author"      : str(message.author),
+                "created_at"  : message.created_at.isoformat(),
+                "edited_at"   : message.edited_at.isoformat() if message.edited_at else None,
+                "content"     : message.content,
+                "attachments" : attachments,
+                "embeds"      : [embed.to_dict() for embed in message.embeds]
+            }, ensure_ascii=False) + "\n"
+
+        line = "[" + message.created_at.strftime("%Y-%m-%d %H:%M:%S") + "] " + str(message.author) + " (" + str(message.author.id) + "): " + message.content
+        if message.edited_at:
+            line += " (edited " + message.edited_at.strftime("%Y-%m-%d %H:%M:%S") + ")"
+        for attachment in attachments:
+            line += "\n    [attachment] " + attachment["filename"] + " " + attachment["url"]
+        return line + "\n"
+
+    async def add(self, message : Message):
+        record : bytes = self.format_message(message).encode("utf-8")
+
+        # The compressed size is only known once the compressor flushes, so flush whenever the worst case could overflow
+        if self.buffer.tell() + self.unflushed + len(record) > self.size_limit:
+            self.gzip.flush()
+            self.unflushed = 0
+            if self.written > 0 and self.buffer.tell() + len(record) > self.size_limit:
+                written = self.written
+                await self.send_part(self.finish_part(), self.parts, self.last_id, written)
+
+        self.gzip.write(record)
+        self.unflushed     += len(record)
+        self.written       += 1
+        self.message_count += 1
+        self.last_id        = message.id
+        self.authors.add(message.author.id)
+        self.first_time = self.first_time or message.created_at
+        self.last_time  = message.created_at
+
+    def finish_part(self) -> discord.File:
+        self.gzip.close()
+        self.buffer.seek(0)
+        self.parts += 1
+        suffix   : str = "" if self.parts == 1 else "-part" + str(self.parts)
+        filename : str = self.name + suffix + TRANSCRIPT_FORMATS[self.format]
+        part : discord.File = discord.File(self.buffer, filename=filename)
+        self.start_part()
+        return part
+
+    def close(self) -> discord.File:
+        '''Finishes the final part and returns it, so it can be posted along with the summary'''
+        return self.finish_part()
+
+    def summary(self, title : str) -> Embed:
+        embed = discord.Embed(title=title, description="Archived as a gzip'd `" + self.format + "` transcript.", color=0xff4500)
+        embed.add_field(name="Messages",     value=str(self.message_count))
+        embed.add_field(name="Participants", value=str(len(self.authors)))
+        embed.add_field(name="Files",        value=str(self.parts))
+        if self.first_time is not None:
+            embed.add_field(name="Timespan", value=self.first_time.strftime("%Y-%m-%d %H:%M") + " to " +
+                                                   self.last_time .strftime("%Y-%m-%d %H:%M") + " UTC", inline=False)
+        return embed
+
 class Threadweaver(commands.Cog):
     """Threadweaver creates temporary channels based on emoji :thread: reactions."""
 
     def __init__(self, bot):
         self.bot                    : Client              = bot
-        self.thread_category        : CategoryChannel     = None
-        self.thread_archive_channel : TextChannel         = None
+        self.guild_structure        : dict[int, GuildStructure]          = {} # guild id -> its category and archive channel
+        self.structure_locks        : KeyedLock           = KeyedLock() # Per guild; one structure check/creation at a time
+        self.creation_locks         : KeyedLock           = KeyedLock() # Per source message; one thread per message
+        self.archive_locks          : KeyedLock           = KeyedLock() # Per guild; embed archives are written one thread at a time
+        self.archive_jobs           : dict[int, ArchiveJob]              = {} # thread channel id -> running archive
         self.thread_priority        : int                 = 2147483646
+        self.thread_registry        : dict[int, dict[str, ThreadRecord]] = {} # guild id -> source message id -> thread
+        self.thread_channels        : dict[int, ThreadRecord]            = {} # thread channel id -> thread
+        self.guild_settings         : dict[int, dict]                    = {} # guild id -> snapshot of its Config
+        self.thread_activity        : dict[int, datetime]                = {} # thread channel id -> time of its latest message
+        self.prune_tasks            : dict[int, asyncio.Task]            = {} # guild id -> idle thread pruner
+        self.membership_batches     : dict[int, MembershipBatch]         = {} # thread channel id -> pending joins/leaves
+        self.thread_overwrites      : dict[int, tuple]                   = {} # thread channel id -> (time sent, {target id -> (target, overwrite)})
+        self.source_messages        : LRUCache            = LRUCache(SOURCE_CACHE_SIZE, SOURCE_CACHE_SECONDS) # message id -> SourceMessage
+        self.stats                  : ThreadweaverStats   = ThreadweaverStats()
+        self.scheduler              : ActionScheduler     = ActionScheduler(self.bot.loop, self.stats)
         #self.user_rate_limit        : dict[int, datetime] = []
 
         self.config = Config.get_conf(self, identifier=786340) # THREAD in 1337
@@ -27,12 +627,227 @@ class Threadweaver(commands.Cog):
             "welcome_message"      : "Welcome <@USER> to the thread!",
             "farewell_message"     : "<@USER> has left the thread!",
             "hide_threads"         : False,
+            "membership_debounce_seconds" : 2, # Joins and leaves within this window share one permission edit and message
             "trigger_emoji"        : "🧵",
             "prune_interval_days"  : 1,
+            "guild_channel_headroom" : 25, # The least active threads are archived to keep this many channels free under Discord's limit
+            "archive_format"       : "embeds", # Or "jsonl"/"text" to archive threads as a single gzip'd transcript file
             "min_role_to_create"   : "IMPERATOR⚔️" # This is inactive if the role doesn't exist
             #"user_threads_per_hour": 3
         }
         self.config.register_guild(**guild_defaults)
+        self.config.register_global(stats_log_interval_minutes=0) # 0 disables the periodic stats log line
+        self.config.register_channel(archive_checkpoint=None)     # Progress of an unfinished archive of this thread
+
+        self.init_task = self.bot.loop.create_task(self.initialize())
+        self.stats_log_task = self.bot.loop.create_task(self.stats_log_loop())
+
+    async def initialize(self):
+        '''Index the existing threads of every guild once the bot has connected'''
+        await self.bot.wait_until_ready()
+        for guild in self.bot.guilds:
+            self.index_guild(guild)
+            await self.get_settings(guild)
+            self.start_pruner(guild)
+        await self.resume_archive_jobs()
+        logger.info(msg="[THREADWEAVER] Indexed "+str(len(self.thread_channels))+" threads across "+str(len(self.bot.guilds))+" guilds")
+
+    def cog_unload(self):
+        self.init_task.cancel()
+        self.stats_log_task.cancel()
+        self.scheduler.cancel()
+        for job in self.archive_jobs.values():
+            job.task.cancel() # Their checkpoints are kept, so they resume when the cog is loaded again
+        for task in self.prune_tasks.values():
+            task.cancel()
+        for batch in self.membership_batches.values():
+            batch.task.cancel()
+
+    async def get_settings(self, guild : Guild) -> dict:
+        '''Returns the in-memory snapshot of a guild's settings, reading it from Config only on first use'''
+        settings : dict = self.guild_settings.get(guild.id)
+        if settings is None:
+            settings = await self.config.guild(guild).get_raw()
+            self.guild_settings[guild.id] = settings
+        return settings
+
+    def register_thread(self, channel : TextChannel) -> ThreadRecord:
+        '''Adds a channel to the thread registry if its topic marks it as a thread; returns None otherwise'''
+        topic : str = getattr(channel, 'topic', None)
+        if topic is None:
+            return None
+        match : re.Match = THREAD_TOPIC_PATTERN.match(topic)
+        if match is None:
+            return None
+        record = ThreadRecord(channel.guild.id, channel.id, match.group(1), int(match.group(2)))
+        self.thread_registry.setdefault(channel.guild.id, {})[record.source_key] = record
+        self.thread_channels[channel.id] = record
+        return record
+
+    def unregister_thread(self, guild_id : int, channel_id : int):
+        '''Removes a channel from the thread registry, if it was registered'''
+        record : ThreadRecord = self.thread_channels.pop(channel_id, None)
+        if record is None:
+            return
+        guild_threads = self.thread_registry.get(guild_id, {})
+        if guild_threads.get(record.source_key) is record:
+            del guild_threads[record.source_key]
+            # Legacy keys are only 4 digits, so another thread may share this one; let the lookup find that one instead
+            for other in (self.thread_channels.values() if len(record.source_key) <= 4 else ()):
+                if other.guild_id == guild_id and other.source_key == record.source_key:
+                    guild_threads[other.source_key] = other
+                    break
+        self.thread_activity.pop(channel_id, None)
+
+    def index_guild(self, guild : Guild):
+        '''(Re)builds the thread registry for a single guild'''
+        self.forget_guild(guild.id)
+        self.thread_registry[guild.id] = {}
+        for channel in guild.text_channels:
+            self.register_thread(channel)
+
+    def forget_guild(self, guild_id : int):
+        '''Drops every registry entry belonging to a guild'''
+        self.thread_registry.pop(guild_id, None)
+        for record in [record for record in self.thread_channels.values() if record.guild_id == guild_id]:
+            self.thread_channels.pop(record.channel_id, None)
+            self.thread_activity.pop(record.channel_id, None)
+            self.thread_overwrites.pop(record.channel_id, None)
+
+    def find_thread(self, guild : Guild, message_id : int) -> TextChannel:
+        '''Looks up the thread spun off from a message; None if there isn't one'''
+        guild_threads = self.thread_registry.get(guild.id)
+        if not guild_threads:
+            return None
+        message_key = str(message_id)
+        record : ThreadRecord = guild_threads.get(message_key) or guild_threads.get(message_key[-4:])
+        if record is None:
+            return None
+        channel : TextChannel = guild.get_channel(record.channel_id)
+        if channel is None: # The channel disappeared without us hearing about it
+            self.unregister_thread(guild.id, record.channel_id)
+        return channel
+
+    def guild_threads(self, guild : Guild) -> list[TextChannel]:
+        '''Every live thread channel in a guild, according to the registry'''
+        threads : list[TextChannel] = []
+        # Walk every registered thread rather than the lookup, where legacy threads sharing a 4-digit key shadow each other
+        for record in [record for record in self.thread_channels.values() if record.guild_id == guild.id]:
+            channel : TextChannel = guild.get_channel(record.channel_id)
+            if channel is None:
+                self.unregister_thread(guild.id, record.channel_id)
+            else:
+                threads.append(channel)
+        return threads
+
+    def last_activity(self, channel : TextChannel) -> datetime:
+        '''When a thread last saw a message; falls back to the last_message_id snowflake, then the channel's creation'''
+        latest : datetime = self.thread_activity.get(channel.id)
+        if latest is None:
+            if channel.last_message_id is not None:
+                latest = discord.utils.snowflake_time(channel.last_message_id)
+            else:
+                latest = channel.created_at
+            self.thread_activity[channel.id] = latest
+        return latest
+
+    def start_pruner(self, guild : Guild):
+        '''Starts the background task that archives this guild's idle threads, unless it is already running'''
+        task : asyncio.Task = self.prune_tasks.get(guild.id)
+        if task is None or task.done():
+            self.prune_tasks[guild.id] = self.bot.loop.create_task(self.prune_loop(guild.id))
+
+    def stop_pruner(self, guild_id : int):
+        task : asyncio.Task = self.prune_tasks.pop(guild_id, None)
+        if task is not None:
+            task.cancel()
+
+    async def prune_loop(self, guild_id : int):
+        '''Periodically archives the threads of one guild that have been idle for longer than prune_interval_days'''
+        while True:
+            guild : Guild = self.bot.get_guild(guild_id)
+            if guild is None:
+                return
+            interval_days = (await self.get_settings(guild))["prune_interval_days"]
+            await sleep(max(60, min(PRUNE_CHECK_SECONDS, interval_days * 86400)))
+
+            guild : Guild = self.bot.get_guild(guild_id)
+            if guild is None:
+                return
+            try:
+                await self.prune_guild(guild)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception(msg="[THREADWEAVER] Failed to prune the idle threads of "+str(guild))
+
+    @instrumented("prune")
+    async def prune_guild(self, guild : Guild):
+        '''Archives every thread in the guild whose latest activity is older than prune_interval_days'''
+        interval_days = (await self.get_settings(guild))["prune_interval_days"]
+        cutoff : datetime = datetime.utcnow() - timedelta(days=interval_days)
+        idle_threads : list[TextChannel] = [channel for channel in self.guild_threads(guild) if self.last_activity(channel) < cutoff]
+        if len(idle_threads) == 0:
+            return
+
+        jobs : list[ArchiveJob] = []
+        for channel in idle_threads:
+            logger.info(msg="[THREADWEAVER] Archiving idle thread #"+str(channel)+" in "+str(guild))
+            jobs.append(self.start_archive_job(channel))
+        await asyncio.gather(*(job.task for job in jobs))
+
+    @Cog.listener()
+    async def on_message(self, message : Message):
+        if message.channel.id in self.thread_channels:
+            self.thread_activity[message.channel.id] = message.created_at
+
+    @Cog.listener()
+    async def on_raw_message_edit(self, payload):
+        self.source_messages.pop(payload.message_id) # So threads made from it afterwards quote the edited text
+
+    @Cog.listener()
+    async def on_raw_message_delete(self, payload):
+        self.source_messages.pop(payload.message_id)
+
+    @Cog.listener()
+    async def on_guild_channel_create(self, channel):
+        self.register_thread(channel)
+        structure : GuildStructure = self.guild_structure.get(channel.guild.id)
+        if structure is not None:
+            structure.add_channel(channel)
+
+    @Cog.listener()
+    async def on_guild_channel_delete(self, channel):
+        self.unregister_thread(channel.guild.id, channel.id)
+        self.thread_overwrites.pop(channel.id, None)
+        structure : GuildStructure = self.guild_structure.get(channel.guild.id)
+        if structure is not None:
+            structure.remove_channel(channel)
+
+    @Cog.listener()
+    async def on_guild_channel_update(self, before, after):
+        if getattr(before, 'topic', None) != getattr(after, 'topic', None):
+            self.unregister_thread(before.guild.id, before.id)
+            self.register_thread(after)
+        sent : tuple = self.thread_overwrites.get(after.id)
+        if sent is not None and self.overwrite_pairs(after) == { target_id : overwrite.pair() for target_id, (target, overwrite) in sent[1].items() }:
+            del self.thread_overwrites[after.id] # The gateway has caught up with our last edit, so the cache can be trusted again
+        structure : GuildStructure = self.guild_structure.get(after.guild.id)
+        if structure is not None and before.category_id != after.category_id:
+            structure.remove_channel(before)
+            structure.add_channel(after)
+
+    @Cog.listener()
+    async def on_guild_join(self, guild : Guild):
+        self.index_guild(guild)
+        self.start_pruner(guild)
+
+    @Cog.listener()
+    async def on_guild_remove(self, guild : Guild):
+        self.forget_guild(guild.id)
+        self.guild_settings.pop(guild.id, None)
+        self.guild_structure.pop(guild.id, None)
+        self.stop_pruner(guild.id)
 
     @commands.command(name="threadweaver-settings",
                       description='Threadweaver Configuration; update them with [p]threadweaver-update-setting')
@@ -82,7 +897,14 @@ class Threadweaver(commands.Cog):
         try:
             oldValue = await self.config.guild(ctx.guild).get_raw(settingName)
             newValue = self.parse_str(value)
+            if settingName == "archive_format" and newValue not in ARCHIVE_FORMATS:
+                embed=discord.Embed(title="Threadweaver Setting Not Updated", color=0xff4500,
+                    description="`archive_format` must be one of " + ", ".join("`" + name + "`" for name in ARCHIVE_FORMATS))
+                await ctx.send(embed=embed)
+                return
             await self.config.guild(ctx.guild).set_raw(settingName, value=newValue)
+            self.guild_settings.pop(ctx.guild.id, None) # Reload the snapshot on next use
+            self.guild_structure.pop(ctx.guild.id, None) # The category or archive names may have changed
             embed.add_field(name=settingName, value=str(oldValue) + " --> " + str(newValue))
         except KeyError:
             # KeyError is thrown on bad keys
@@ -95,49 +917,214 @@ class Threadweaver(commands.Cog):
         embed.set_footer(text=f'View all settings with "'+str(prefixes[0])+'threadweaver-settings"')
         await ctx.send(embed=embed)
 
+    def queue_depths(self) -> dict:
+        '''How much deferred work is waiting right now'''
+        return {
+            "membership_batches" : len(self.membership_batches),
+            "membership_changes" : sum(len(batch.changes) for batch in self.membership_batches.values()),
+            "pruners"            : sum(1 for task in self.prune_tasks.values() if not task.done()),
+            "scheduled_writes"   : self.scheduler.depth(),
+            "archive_jobs"       : len(self.archive_jobs),
+            "cached_sources"     : len(self.source_messages)
+        }
+
+    async def stats_log_loop(self):
+        '''Logs a structured stats line every stats_log_interval_minutes, while that is above 0'''
+        await self.bot.wait_until_ready()
+        while True:
+            minutes = await self.config.stats_log_interval_minutes()
+            if not minutes or minutes <= 0:
+                await sleep(60) # Check again later in case it gets switched on
+                continue
+            await sleep(minutes * 60)
+            logger.info(msg="[THREADWEAVER] stats " + json.dumps(dict(self.stats.snapshot(), queues=self.queue_depths())))
+
+    @commands.command(name="threadweaver-stats",
+                      description="[MOD] Shows what Threadweaver's hot paths have cost since the cog was loaded")
+    @commands.has_permissions(manage_guild=True)
+    @commands.guild_only()
+    async def threadweaver_stats(self, ctx):
+        """Print Threadweaver's Runtime Statistics to Discord."""
+        embed=discord.Embed(title="Threadweaver Runtime Statistics", color=0xff4500,
+            description="Since " + self.stats.started.strftime("%Y-%m-%d %H:%M") + " UTC, across all servers")
+        embed.set_author(name=ctx.bot.user.name, icon_url=ctx.bot.user.avatar_url)
+
+        # One field per instrumented path: how often it ran, how long it took, and the REST calls it made
+        for path, histogram in sorted(self.stats.latency.items()):
+            rest_calls = self.stats.rest_calls[path]
+            embed.add_field(name=path, inline=False, value=
+                "`" + str(histogram.count) + "` calls, `" + "{:.1f}".format(histogram.total) + "`s total; " +
+                "p50 `" + "{:.0f}".format(histogram.percentile(0.5)) + "`ms, p99 `" + "{:.0f}".format(histogram.percentile(0.99)) +
+                "`ms, max `" + "{:.0f}".format(histogram.max * 1000) + "`ms\n" +
+                "`" + str(rest_calls) + "` REST calls (`" + "{:.2f}".format(rest_calls / histogram.count) + "` per call)")
+
+        throughput = self.stats.archived / self.stats.archive_seconds if self.stats.archive_seconds else 0.0
+        embed.add_field(name="Archive throughput", value="`" + str(self.stats.archived) + "` messages at `" + "{:.1f}".format(throughput) + "` messages/s\n" +
+                                                         "`" + str(self.stats.evicted) + "` threads archived early to stay under the channel limit")
+        embed.add_field(name="Queues", value="\n".join(name + ": `" + str(depth) + "`" for name, depth in self.queue_depths().items()))
+        lookups = self.source_messages.hits + self.source_messages.misses
+        embed.add_field(name="Source message cache", value="`" + str(self.source_messages.hits) + "` hits of `" + str(lookups) + "` lookups (`" +
+                                                           "{:.0%}".format(self.source_messages.hits / lookups if lookups else 0) + "`)")
+        structure : GuildStructure = self.guild_structure.get(ctx.guild.id)
+        if structure is not None:
+            embed.add_field(name="Channels in this server", value="`" + str(structure.guild_load()) + "` of `" + str(GUILD_CHANNEL_LIMIT) + "`; thread categories: " +
+                ", ".join("`" + str(structure.category_load(category.id)) + "`" for category in structure.categories(ctx.guild)))
+        embed.add_field(name="REST calls for this server", value="`" + str(self.stats.guild_rest[ctx.guild.id]) + "` of `" +
+                                                                  str(sum(self.stats.rest_calls.values())) + "`")
+        await ctx.send(embed=embed)
+
+    @commands.command(name="threadweaver-stats-log",
+                      description="[OWNER] Log Threadweaver's statistics as a JSON line every N minutes; 0 turns it off")
+    @commands.is_owner()
+    async def threadweaver_stats_log(self, ctx, minutes : int):
+        """Set how often Threadweaver logs its runtime statistics."""
+        await self.config.stats_log_interval_minutes.set(max(0, minutes))
+        await ctx.send("Threadweaver will " + ("log its statistics every " + str(minutes) + " minute(s)." if minutes > 0 else "no longer log its statistics."))
+
     async def make_channel_friendly(self, name : str, guild : Guild):
         '''Removes the spaces and upper-case characters from a name; not exhaustive or robust'''
-        sep = await self.config.guild(guild).name_separator()
+        sep = (await self.get_settings(guild))["name_separator"]
         return name.replace(" ", sep).lower()
         
     def get_thread_owner(self, guild : Guild, thread : TextChannel) -> Member :
-        '''Parses thread topics to get the owning member of a thread; None if not a thread'''
-        thread_topic : str = thread.topic
-        if(thread_topic.startswith("[THREAD]")):
-            match  : re.Match = re.search(r"<@[0-9]*?>", thread_topic)
-            owner_id = int(match.group()[2:-1])
-            member : Member   = discord.utils.get(guild.members, id=owner_id)
-            return member
-        else:
+        '''Looks up the owning member of a thread in the thread registry; None if not a thread (or the owner left)'''
+        record : ThreadRecord = self.thread_channels.get(thread.id) or self.register_thread(thread)
+        if record is None:
             return None
+        return guild.get_member(record.owner_id)
+
+    async def get_source_message(self, guild : Guild, channel_id : int, message_id : int) -> SourceMessage:
+        '''Fetches the message a thread is spun off from, unless it is still cached from an earlier reaction'''
+        source : SourceMessage = self.source_messages.get(message_id)
+        if source is None:
+            channel : TextChannel = guild.get_channel(channel_id)
+            self.stats.rest(guild)
+            source = SourceMessage(await channel.fetch_message(message_id))
+            self.source_messages.put(message_id, source)
+        return source
+
+    async def send_embeds(self, channel : TextChannel, embeds : list[Embed]):
+        '''Posts several embeds as a single message without pinging anyone'''
+        # Messageable.send only takes one embed, so go through the HTTP client directly; it still waits out
+        # the channel's rate limit bucket (and retries on 429s) using the headers Discord sends back
+        route = Route("POST", "/channels/{channel_id}/messages", channel_id=channel.id)
+        await self.bot.http.request(route, json={
+            "embeds"           : [embed.to_dict() for embed in embeds],
+            "allowed_mentions" : AllowedMentions.none().to_dict()
+        })
+
+    def start_archive_job(self, channel : TextChannel) -> ArchiveJob:
+        '''Starts archiving a thread in the background, unless that is already happening; returns the job either way'''
+        job : ArchiveJob = self.archive_jobs.get(channel.id)
+        if job is None:
+            job = self.archive_jobs[channel.id] = ArchiveJob(channel.id)
+            job.task = self.bot.loop.create_task(self.run_archive_job(channel, job))
+        return job
+
+    async def run_archive_job(self, channel : TextChannel, job : ArchiveJob):
+        '''Archives a thread from its last checkpoint; the channel and checkpoint are only deleted once everything is mirrored'''
+        checkpoint = self.config.channel(channel).archive_checkpoint
+        try:
+            saved : dict = await checkpoint()
+            if saved is not None:
+                job.load(saved)
+            job.loaded.set()
+            if saved is None:
+                await checkpoint.set(job.checkpoint()) # So a restart before the first batch still picks this thread up
+            await self.archive_thread(channel, job)
+            await checkpoint.clear()
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            job.error = error
+            logger.exception(msg="[THREADWEAVER] Archiving #"+str(channel)+" failed after "+str(job.archived)+" messages; it will resume from there")
+        finally:
+            job.loaded.set() # Even if reading the checkpoint failed, nobody should wait on it forever
+            if self.archive_jobs.get(channel.id) is job:
+                del self.archive_jobs[channel.id]
+
+    async def save_checkpoint(self, channel : TextChannel, job : ArchiveJob, last_message_id : int, archived : int):
+        '''Records that everything up to last_message_id has been mirrored'''
+        job.last_message_id  = last_message_id
+        job.archived        += archived
+        await self.config.channel(channel).archive_checkpoint.set(job.checkpoint())
+
+    async def resume_archive_jobs(self):
+        '''Restarts the archives that were interrupted by a restart or an error'''
+        for channel_id, data in (await self.config.all_channels()).items():
+            if data.get("archive_checkpoint") is None:
+                continue
+            channel : TextChannel = self.bot.get_channel(channel_id)
+            if channel is None: # The thread was deleted by someone else in the meantime
+                await self.config.channel_from_id(channel_id).archive_checkpoint.clear()
+                continue
+            logger.info(msg="[THREADWEAVER] Resuming the archive of #"+str(channel)+" in "+str(channel.guild))
+            self.start_archive_job(channel)
 
-    async def archive_thread(self, channel : TextChannel):
-        '''Read the first 5000 messages of the thread, mirror them to the thread archive, and delete the channel'''
-        full_history : list[Message] = await channel.history(limit=5000, oldest_first=True).flatten()
-        text_buffer  : str           = ""
-        for thread_message in full_history:
-            next_message = "<@"+str(thread_message.author.id)+">: "+thread_message.content + "\n"
-
-            # If the text buffer is above the field limit, cut off a new message
-            if(len(text_buffer) + len(next_message) > 1999):
-                # Post embed
-                embed=discord.Embed(description=text_buffer, color=0xff4500)
-                #embed.set_author(name=thread_message.author.display_name, icon_url=thread_message.author.avatar_url)
-                await self.thread_archive_channel.send(title=channel.name, embed=embed, 
-                    allowed_mentions=AllowedMentions(everyone=False, users=False, roles=False))
-                text_buffer = ""
-                await sleep(1.01)
-
-            text_buffer += next_message
-
-        # Clean up the remains
-        if(len(text_buffer) > 0):
-            embed=discord.Embed(title=channel.name, description=text_buffer, color=0xff4500)
-            await self.thread_archive_channel.send(embed=embed, 
-                allowed_mentions=AllowedMentions(everyone=False, users=False, roles=False))
+    @instrumented("archive_thread")
+    async def archive_thread(self, channel : TextChannel, job : ArchiveJob):
+        '''Stream the thread's messages (after the job's checkpoint) into the thread archive, and delete the channel'''
+        start           : float          = time.perf_counter()
+        archived_before : int            = job.archived
+        archive_format  : str            = (await self.get_settings(channel.guild))["archive_format"]
+        archive_channel : TextChannel    = (await self.verify_server_structure(channel.guild)).archive_channel(channel.guild)
+        after           : discord.Object = discord.Object(job.last_message_id) if job.last_message_id is not None else None
+        if archive_format not in ARCHIVE_FORMATS: # Stored before unknown values were rejected
+            logger.warning(msg="[THREADWEAVER] Unknown archive_format '"+str(archive_format)+"' in "+str(channel.guild)+"; archiving #"+str(channel)+" as embeds")
+        if archive_format in TRANSCRIPT_FORMATS:
+            await self.archive_thread_transcript(channel, archive_channel, archive_format, job, after)
+        else:
+            # Embed archives span many messages, so only one thread per guild is written at a time to keep them readable
+            async with self.archive_locks(channel.guild.id):
+                async def send(embeds : list[Embed], last_message_id : int, archived : int):
+                    await self.scheduler.run(channel.guild, PRIORITY_BACKGROUND, self.send_embeds, archive_channel, embeds)
+                    await self.save_checkpoint(channel, job, last_message_id, archived)
+
+                title   : str            = channel.name + (" (continued)" if job.resumed else "")
+                batcher : ArchiveBatcher = ArchiveBatcher(send, title)
+                read    : int            = 0
+                async for thread_message in channel.history(limit=None, oldest_first=True, after=after):
+                    if read % 100 == 0:
+                        self.stats.rest(channel.guild) # History is fetched 100 messages per request
+                    read += 1
+                    await batcher.add("<@"+str(thread_message.author.id)+">: "+thread_message.content + "\n", thread_message.id)
+                await batcher.close()
 
         # Delete the thread when we're done
-        await channel.delete(reason="Archived Old Thread; Deleting Thread")
+        await self.scheduler.run(channel.guild, PRIORITY_BACKGROUND, channel.delete, reason="Archived Old Thread; Deleting Thread")
+        structure : GuildStructure = self.guild_structure.get(channel.guild.id)
+        if structure is not None:
+            structure.remove_channel(channel) # Without waiting for the gateway, so eviction doesn't archive one thread too many
+        self.stats.record_archive(job.archived - archived_before, time.perf_counter() - start)
+
+    async def archive_thread_transcript(self, channel : TextChannel, archive_channel : TextChannel, archive_format : str,
+                                        job : ArchiveJob, after : discord.Object):
+        '''Uploads the thread's messages as a gzip'd transcript, followed by a short summary embed'''
+        async def send_part(file : discord.File, part : int, last_message_id : int, archived : int):
+            await self.scheduler.run(channel.guild, PRIORITY_BACKGROUND, archive_channel.send,
+                content="`" + channel.name + "` transcript, part " + str(part), file=file)
+            job.parts = part
+            await self.save_checkpoint(channel, job, last_message_id, archived)
+
+        writer = TranscriptWriter(send_part, channel.name, archive_format, channel.guild.filesize_limit, job.parts, job.archived)
+        read   = 0
+        async for thread_message in channel.history(limit=None, oldest_first=True, after=after):
+            if read % 100 == 0:
+                self.stats.rest(channel.guild) # History is fetched 100 messages per request
+            read += 1
+            await writer.add(thread_message)
+
+        # A resumed job that finds nothing new already uploaded its final part; only deleting the channel was left
+        if job.resumed and read == 0:
+            return
+
+        # Most threads fit in one file, which goes out in the same message as the summary
+        written    : int          = writer.written
+        final_part : discord.File = writer.close()
+        await self.scheduler.run(channel.guild, PRIORITY_BACKGROUND, archive_channel.send,
+            embed=writer.summary(channel.name), file=final_part, allowed_mentions=AllowedMentions.none())
+        job.parts = writer.parts
+        await self.save_checkpoint(channel, job, writer.last_id, written)
 
     @commands.command(name="archive-thread",
                       description="[OP] This command archives all the thread's messages to thread-archive and deletes the thread.")
@@ -147,22 +1134,74 @@ class Threadweaver(commands.Cog):
         thread_owner : Member = self.get_thread_owner(ctx.guild, ctx.channel)
         if thread_owner is not None:
             if(ctx.author.id == thread_owner.id):
-                await self.archive_thread(ctx.channel)
+                job : ArchiveJob = self.start_archive_job(ctx.channel)
+                await job.loaded.wait() # Report where an interrupted archive resumes, not a blank status
+                await ctx.send(job.status())
             else:
                 await ctx.send("Only the thread owner <@"+str(thread_owner.id)+"> may archive this thread.")
 
+    def bulk_progress_embed(self, title : str, done : int, failed : int, total : int, finished : bool = False) -> Embed:
+        embed = discord.Embed(title=title, color=0x00ff00 if finished else 0xff4500,
+            description=("Finished: " if finished else "In progress: ") + str(done) + "/" + str(total) + " threads")
+        if failed > 0:
+            embed.add_field(name="Failed", value=str(failed) + " (see the bot's log)")
+        return embed
+
+    @instrumented("bulk_operation")
+    async def run_bulk_operation(self, ctx, title : str, channels : list[TextChannel], operation, concurrency : int = BULK_CONCURRENCY):
+        '''Awaits operation(channel) for every channel, a few at a time, while keeping a single progress message up to date'''
+        total    : int = len(channels)
+        done     : int = 0
+        failed   : int = 0
+        progress : Message = await ctx.send(embed=self.bulk_progress_embed(title, done, failed, total))
+        last_update : float = self.bot.loop.time()
+
+        # Each operation waits out Discord's rate limits inside the HTTP client, so the semaphore is what turns
+        # those waits into backpressure rather than an ever-growing pile of queued requests
+        semaphore = asyncio.Semaphore(concurrency)
+        async def run_one(channel : TextChannel):
+            nonlocal done, failed, last_update
+            async with semaphore:
+                try:
+                    await operation(channel)
+                except Exception:
+                    failed += 1
+                    logger.exception(msg="[THREADWEAVER] "+title+" failed on #"+str(channel))
+            done += 1
+            if self.bot.loop.time() - last_update >= BULK_PROGRESS_SECONDS:
+                last_update = self.bot.loop.time()
+                with contextlib.suppress(discord.HTTPException): # The progress message may live in one of the threads
+                    await progress.edit(embed=self.bulk_progress_embed(title, done, failed, total))
+
+        await asyncio.gather(*(run_one(channel) for channel in channels))
+        with contextlib.suppress(discord.HTTPException):
+            await progress.edit(embed=self.bulk_progress_embed(title, done, failed, total, finished=True))
+
     @commands.command(name="threadweaver-delete-all-threads",
                       description="[MOD] Deletes all of the threadweaver threads without backing them up")
     @commands.has_permissions(manage_guild=True)
     @commands.guild_only()
     async def delete_all_threads_command(self, ctx : Message):
-        logger.info(msg="[THREADWEAVER] Running command: Delete Threads")
-        for channel in self.bot.get_all_channels():
-            channel : TextChannel = channel
-            if hasattr(channel, 'topic') and channel.topic is not None and channel.topic.startswith("[THREAD]"):
-                logger.info(msg="[THREADWEAVER] Deleting "+str(channel)+"...")
-                await channel.delete(reason="Deleting all threads via the 'threadweaver_delete_all_threads' command")
-                return
+        logger.info(msg="[THREADWEAVER] Running command: Delete Threads in "+str(ctx.guild))
+        async def delete(channel : TextChannel):
+            await self.scheduler.run(channel.guild, PRIORITY_BULK, channel.delete,
+                reason="Deleting all threads via the 'threadweaver_delete_all_threads' command")
+        await self.run_bulk_operation(ctx, "Deleting all threads", self.guild_threads(ctx.guild), delete)
+
+    @commands.command(name="threadweaver-archive-all-threads",
+                      description="[MOD] Archives all of the threadweaver threads to thread-archive and deletes them")
+    @commands.has_permissions(manage_guild=True)
+    @commands.guild_only()
+    async def archive_all_threads_command(self, ctx : Message):
+        logger.info(msg="[THREADWEAVER] Running command: Archive Threads in "+str(ctx.guild))
+        await self.verify_server_structure(ctx.guild)
+
+        async def archive(channel : TextChannel):
+            job : ArchiveJob = self.start_archive_job(channel)
+            await job.task
+            if job.error is not None:
+                raise job.error
+        await self.run_bulk_operation(ctx, "Archiving all threads", self.guild_threads(ctx.guild), archive)
 
     @commands.command(name="rename-thread",
                       description="[OP] This command renames the thread; no spaces!")
@@ -173,172 +1212,310 @@ class Threadweaver(commands.Cog):
         if thread_owner is not None:
             if(ctx.author.id == thread_owner.id):
                 thread : TextChannel = ctx.channel
-                emoji : str = await self.config.guild(ctx.guild).trigger_emoji()
-                await thread.edit(name=emoji + "｜" + await self.make_channel_friendly(new_name, ctx.guild))
+                emoji : str = (await self.get_settings(ctx.guild))["trigger_emoji"]
+                await self.scheduler.run(ctx.guild, PRIORITY_INTERACTIVE, thread.edit,
+                    name=emoji + "｜" + await self.make_channel_friendly(new_name, ctx.guild))
             else:
                 await ctx.send("Only the thread owner <@"+str(thread_owner.id)+"> may rename this thread.")
 
-    async def verify_server_structure(self, guild: Guild):
+    @instrumented("verify_server_structure")
+    async def verify_server_structure(self, guild: Guild) -> GuildStructure:
         """
         This function (run periodically) ensures that the server/guild is set up to use threads.
         It essentially just makes sure the Threads Category and Thread-Archive channel exists.
-        It also backs up old threads into thread-archive.
+        Old threads are backed up into thread-archive separately, by each guild's prune_loop.
         """
-        # Clear these in-case the mods have deleted necessary channels
-        self.thread_category        : CategoryChannel = None
-        self.thread_archive_channel : TextChannel     = None
-
-        # Verify the server is set up with a "Threads" category channel, and a "Thread Archive" Text Channel
-        thread_category_name = await self.config.guild(guild).thread_category_name()
-        for categoryChannel in guild.categories:
-            if(str(categoryChannel) == thread_category_name):
-                self.thread_category = categoryChannel
-
-        # Create the "Threads" Category if it doesn't exist
-        if(self.thread_category is None):
-            logger.info(msg="[THREADWEAVER] Attempting to create the Thread Category...")
-            self.thread_category = await guild.create_category(thread_category_name, reason="Setting up Threading for this Server/'Guild'")
-            if self.thread_category is None:
-                logger.error(msg="[THREADWEAVER] ERROR: Insufficient permissions to create Categories!  Please give me more permissions!")
-
-        # Create the "Thread Archive" Channel if it doesn't exist
-        thread_archive_name = await self.make_channel_friendly(await self.config.guild(guild).thread_archive_name(), guild)
-        for channel in self.bot.get_all_channels():
-            if str(channel) == thread_archive_name:
-                self.thread_archive_channel : TextChannel = channel
-        if(self.thread_archive_channel is None):
-            logger.info(msg="[THREADWEAVER] Attempting to create the thread_archive Channel...")
-            overwrites = { 
-                guild.default_role : discord.PermissionOverwrite(send_messages=False),
-                guild.me           : discord.PermissionOverwrite(send_messages=True, manage_permissions=True) 
-            }
-            self.thread_archive_channel : TextChannel = await guild.create_text_channel(thread_archive_name, 
-                        topic="This channel records conversations from old threads.", category=self.thread_category,
-                        overwrites = overwrites, position=2147483647, reason = "Setting up the server for Threadweaver.")
-            if self.thread_archive_channel is None:
-                logger.error(msg="[THREADWEAVER] ERROR: Insufficient permissions to create Channels!  Please give me more permissions!")
-
-        # Iterate through all the existing threads, checking for the age of the latest message
-        interval_days = await self.config.guild(guild).prune_interval_days()
-        for channel in self.bot.get_all_channels():
-            channel : TextChannel = channel
-            if str(channel) != thread_archive_name and hasattr(channel, 'topic') and channel.topic is not None and channel.topic.startswith("[THREAD]"):
-                latest_message : list[Message] = await channel.history(limit=1).flatten()
-                # If the latest message is older than the time interval, archive the thread
-                if len(latest_message) > 0 and latest_message[0].created_at < datetime.now() - timedelta(days=interval_days):
-                    await self.archive_thread(channel)
+        # The channels found last time are usually still there; this check only touches the guild's cache
+        structure : GuildStructure = self.guild_structure.get(guild.id)
+        if structure is not None and structure.is_intact(guild):
+            return structure
+
+        # Otherwise, let only one caller per guild look for (or create) the channels
+        async with self.structure_locks(guild.id):
+            structure : GuildStructure = self.guild_structure.setdefault(guild.id, GuildStructure())
+            if structure.is_intact(guild):
+                return structure # Someone else set things up while we were waiting
+
+            settings : dict = await self.get_settings(guild)
+
+            # Verify the server is set up with a "Threads" category channel, and a "Thread Archive" Text Channel
+            thread_category : CategoryChannel = structure.category(guild)
+            if thread_category is None:
+                thread_category_name = settings["thread_category_name"]
+                for categoryChannel in guild.categories:
+                    if(str(categoryChannel) == thread_category_name):
+                        thread_category = categoryChannel
+
+                # Create the "Threads" Category if it doesn't exist
+                if(thread_category is None):
+                    logger.info(msg="[THREADWEAVER] Attempting to create the Thread Category...")
+                    thread_category = await self.scheduler.run(guild, PRIORITY_INTERACTIVE, guild.create_category,
+                        thread_category_name, reason="Setting up Threading for this Server/'Guild'")
+                    if thread_category is None:
+                        logger.error(msg="[THREADWEAVER] ERROR: Insufficient permissions to create Categories!  Please give me more permissions!")
+                        return structure
+                structure.category_ids = [thread_category.id]
+
+            # Create the "Thread Archive" Channel if it doesn't exist
+            thread_archive_channel : TextChannel = structure.archive_channel(guild)
+            if thread_archive_channel is None:
+                thread_archive_name = await self.make_channel_friendly(settings["thread_archive_name"], guild)
+                thread_archive_channel = discord.utils.get(guild.text_channels, name=thread_archive_name)
+                if(thread_archive_channel is None):
+                    logger.info(msg="[THREADWEAVER] Attempting to create the thread_archive Channel...")
+                    overwrites = { 
+                        guild.default_role : discord.PermissionOverwrite(send_messages=False),
+                        guild.me           : discord.PermissionOverwrite(send_messages=True, manage_permissions=True) 
+                    }
+                    thread_archive_channel = await self.scheduler.run(guild, PRIORITY_INTERACTIVE, guild.create_text_channel, thread_archive_name,
+                                topic="This channel records conversations from old threads.", category=thread_category,
+                                overwrites = overwrites, position=2147483647, reason = "Setting up the server for Threadweaver.")
+                    if thread_archive_channel is None:
+                        logger.error(msg="[THREADWEAVER] ERROR: Insufficient permissions to create Channels!  Please give me more permissions!")
+                        return structure
+                structure.archive_channel_id = thread_archive_channel.id
+
+            # Count what is in the guild now, so threads can be placed without overrunning Discord's limits
+            structure.index(guild, settings["thread_category_name"])
+
+        return structure
+
+    async def reserve_thread_slot(self, guild : Guild, structure : GuildStructure, settings : dict) -> CategoryChannel:
+        '''Picks the category for a new thread and reserves a place in it; call structure.release() once the thread exists'''
+        # Near the guild's channel limit, start archiving the least active threads to make room
+        self.evict_threads(guild, structure, settings)
+        while structure.guild_load() >= GUILD_CHANNEL_LIMIT:
+            # No room at all until an archive finishes; waiting for one beats a request Discord would refuse
+            archiving : list[asyncio.Task] = [job.task for channel_id, job in self.archive_jobs.items() if channel_id in structure.channel_ids]
+            if len(archiving) == 0:
+                break # Nothing we can free up; let Discord have the final say
+            await asyncio.wait(archiving, return_when=asyncio.FIRST_COMPLETED)
+
+        # The first thread category with room, in order
+        for category in structure.categories(guild):
+            if structure.category_load(category.id) < CATEGORY_CHANNEL_LIMIT:
+                structure.reserve(category.id)
+                return category
+
+        # They're all full, so open the next overflow category (one caller per guild)
+        async with self.structure_locks(guild.id):
+            categories : list[CategoryChannel] = structure.categories(guild)
+            for category in categories: # A thread may have been archived, or a category created, while we waited
+                if structure.category_load(category.id) < CATEGORY_CHANNEL_LIMIT:
+                    structure.reserve(category.id)
+                    return category
+
+            category_name : str = settings["thread_category_name"]
+            last_number   : str = str(categories[-1])[len(category_name) + 1:] if len(categories) > 0 else ""
+            overflow_name : str = category_name + " " + str(int(last_number) + 1 if last_number.isdigit() else 2)
+            logger.info(msg="[THREADWEAVER] The thread categories of "+str(guild)+" are full; creating "+overflow_name)
+            category : CategoryChannel = await self.scheduler.run(guild, PRIORITY_INTERACTIVE, guild.create_category,
+                overflow_name, reason="The thread category is full")
+            structure.add_category(category)
+            structure.reserve(category.id)
+            return category
+
+    def evict_threads(self, guild : Guild, structure : GuildStructure, settings : dict) -> list[ArchiveJob]:
+        '''Starts archiving the least recently active threads once the guild is within guild_channel_headroom of Discord's limit'''
+        archiving : int = sum(1 for channel_id in self.archive_jobs if channel_id in structure.channel_ids)
+        excess    : int = structure.guild_load() + 1 - archiving - (GUILD_CHANNEL_LIMIT - settings["guild_channel_headroom"]) # +1 for the new thread
+        if excess <= 0:
+            return []
+
+        candidates : list[TextChannel] = [channel for channel in self.guild_threads(guild) if channel.id not in self.archive_jobs]
+        jobs       : list[ArchiveJob]  = []
+        for channel in heapq.nsmallest(excess, candidates, key=self.last_activity):
+            logger.info(msg="[THREADWEAVER] "+str(guild)+" is close to Discord's channel limit; archiving its least active thread #"+str(channel))
+            jobs.append(self.start_archive_job(channel))
+        self.stats.evicted += len(jobs)
+        return jobs
+
+    def queue_membership(self, thread_channel : TextChannel, member_id : int, joined : bool, settings : dict):
+        '''Records a join or leave, to be applied along with the others that arrive within membership_debounce_seconds'''
+        batch : MembershipBatch = self.membership_batches.get(thread_channel.id)
+        if batch is None:
+            batch = self.membership_batches[thread_channel.id] = MembershipBatch()
+            batch.task = self.bot.loop.create_task(self.apply_membership(thread_channel.guild.id, thread_channel.id,
+                                                                         settings["membership_debounce_seconds"]))
+        # A join and a leave within the same window cancel out, so nobody is welcomed or sent off for a toggle
+        if batch.before.setdefault(member_id, not joined) == joined:
+            batch.changes.pop(member_id, None)
+        else:
+            batch.changes[member_id] = joined
+
+    def overwrite_pairs(self, channel : TextChannel) -> dict[int, tuple]:
+        '''A channel's raw overwrites as target id -> (allow, deny), including members that aren't cached'''
+        return { overwrite.id : (discord.Permissions(overwrite.allow), discord.Permissions(overwrite.deny)) for overwrite in channel._overwrites }
+
+    def current_overwrites(self, thread_channel : TextChannel) -> dict[int, tuple]:
+        '''A thread's overwrites as target id -> (target, overwrite); the set we last sent until the gateway confirms it'''
+        sent : tuple = self.thread_overwrites.get(thread_channel.id)
+        if sent is not None:
+            if time.monotonic() - sent[0] <= OVERWRITE_ECHO_SECONDS:
+                return dict(sent[1])
+            del self.thread_overwrites[thread_channel.id] # No matching echo in time (e.g. a mod edited it meanwhile); trust the cache again
+
+        # channel.overwrites leaves out members that aren't cached, so build them from the raw overwrites instead
+        guild : Guild = thread_channel.guild
+        overwrites : dict[int, tuple] = {}
+        for overwrite in thread_channel._overwrites:
+            if overwrite.type == "role":
+                target = guild.get_role(overwrite.id)
+                if target is None:
+                    continue # Discord drops the overwrites of deleted roles itself
+            else:
+                target = guild.get_member(overwrite.id) or discord.Object(overwrite.id) # Anything but a Role is sent as a member
+            overwrites[overwrite.id] = (target, discord.PermissionOverwrite.from_pair(discord.Permissions(overwrite.allow), discord.Permissions(overwrite.deny)))
+        return overwrites
+
+    async def apply_membership(self, guild_id : int, channel_id : int, delay : float):
+        '''Waits out the debounce window, then flushes whatever joined or left the thread in the meantime'''
+        await sleep(delay)
+        await self.flush_membership(guild_id, channel_id)
+
+    @instrumented("membership_batch")
+    async def flush_membership(self, guild_id : int, channel_id : int):
+        '''Applies a thread's pending joins and leaves with one permission edit, one welcome and one farewell message'''
+        batch : MembershipBatch = self.membership_batches.pop(channel_id, None)
+        guild : Guild           = self.bot.get_guild(guild_id)
+        thread_channel : TextChannel = guild.get_channel(channel_id) if guild is not None else None
+        if batch is None or thread_channel is None:
+            return
+        settings : dict = await self.get_settings(guild)
+        joins  : list[int] = [member_id for member_id, joined in batch.changes.items() if joined]
+        leaves : list[int] = [member_id for member_id, joined in batch.changes.items() if not joined]
+
+        # Add the joining users to the thread if threads are hidden, and reset the leaving users' permissions to default
+        overwrites : dict[int, tuple] = self.current_overwrites(thread_channel)
+        changed    = False
+        if settings["hide_threads"]:
+            for member_id in joins:
+                member : Member = guild.get_member(member_id)
+                if member is not None and member_id not in overwrites:
+                    overwrites[member_id] = (member, discord.PermissionOverwrite(read_messages=True))
+                    changed = True
+        for member_id in leaves:
+            if member_id in overwrites:
+                del overwrites[member_id]
+                changed = True
+        if changed:
+            # TextChannel.edit doesn't update the cache, so later batches build on this set until the gateway echoes it back
+            sent : tuple = (time.monotonic(), overwrites)
+            self.thread_overwrites[channel_id] = sent
+            try:
+                await self.scheduler.run(guild, PRIORITY_INTERACTIVE, thread_channel.edit, overwrites=dict(overwrites.values()),
+                    reason = str(len(joins)) + " member(s) added and " + str(len(leaves)) + " member(s) removed their :thread: emoji.")
+            except Exception:
+                # Nothing was applied, so later batches must not build on this set
+                if self.thread_overwrites.get(channel_id) is sent:
+                    del self.thread_overwrites[channel_id]
+                raise
+
+        # Send the Welcome and Farewell Messages if they exist
+        welcome_message  = settings["welcome_message"]
+        farewell_message = settings["farewell_message"]
+        if joins and welcome_message and len(welcome_message) > 0:
+            await self.scheduler.run(guild, PRIORITY_MESSAGE, thread_channel.send, welcome_message.replace("<@USER>", ", ".join("<@" + str(member_id) + ">" for member_id in joins)))
+        if leaves and farewell_message and len(farewell_message) > 0:
+            await self.scheduler.run(guild, PRIORITY_MESSAGE, thread_channel.send, farewell_message.replace("<@USER>", ", ".join("<@" + str(member_id) + ">" for member_id in leaves)))
 
     @Cog.listener()
+    @instrumented("reaction_add")
     async def on_raw_reaction_add(self, payload: RawReactionActionEvent) -> None:
             """
             Manage thread creation and user permissions.
             """
-            # Get the metadata about the message's channel, and message itself
-            channel : TextChannel = discord.utils.get(self.bot.get_all_channels(), id=payload.channel_id)
-            message : Message     = await channel.fetch_message(payload.message_id)
-            guild   : Guild       = message.guild
+            # Is the emoji in the reaction a :thread:?  Only the gateway payload and cached settings are consulted,
+            # so the vast majority of reactions are dropped here without any API calls or Config reads
+            guild   : Guild       = self.bot.get_guild(payload.guild_id) if payload.guild_id is not None else None
             if guild is None:
                 return
+            settings : dict = await self.get_settings(guild)
+            trigger_emoji = settings["trigger_emoji"]
+            if payload.emoji.name != trigger_emoji:
+                return
+
+            # Simultaneous reactions on the same message are handled one at a time, so only the first creates a thread
+            async with self.creation_locks(payload.message_id):
+                # Add the user to the thread if it already exists
+                thread_channel : TextChannel = self.find_thread(guild, payload.message_id)
+                if thread_channel is not None:
+                    self.queue_membership(thread_channel, payload.user_id, True, settings)
+                    return # End execution here
+
+                # Otherwise, get the reacting member (the gateway includes it with the reaction), and check if we should
+                # be limiting them before spending any requests on the message
+                member  : Member      = payload.member or guild.get_member(payload.user_id)
+                min_role_name = settings["min_role_to_create"]
+                guild_roles  : list[Role] = guild .roles
+                member_roles : list[Role] = member.roles
+                for role in guild_roles:
+                    if(str(min_role_name) == str(role)):
+                        if member_roles[-1].position < role.position:
+                            await self.scheduler.run(guild, PRIORITY_INTERACTIVE, self.bot.http.remove_reaction,
+                                payload.channel_id, payload.message_id, trigger_emoji, member.id)
+                            return # This user's role is too low to create a thread
 
-            # Is the emoji in the reaction a :thread:?
-            trigger_emoji = await self.config.guild(guild).trigger_emoji()
-            if payload.emoji.name == trigger_emoji:
-                # If so, get the metadata about the message's member
-                member  : Member      = discord.utils.get(guild.members, id=payload.user_id)
+                # Then get the message itself; people toggle 🧵 on the same messages, so it's usually cached
+                message : SourceMessage = await self.get_source_message(guild, payload.channel_id, payload.message_id)
 
                 # Ensure that the server structure contains the necessary categories
-                await self.verify_server_structure(guild)
+                structure : GuildStructure = await self.verify_server_structure(guild)
 
-                thread_channel = None
-                thread_name    = await self.make_channel_friendly(await self.config.guild(guild).thread_prefix() + " " + 
-                                        str(message.author.name), guild)
+                thread_name    = await self.make_channel_friendly(settings["thread_prefix"] + " " + 
+                                        str(message.author_name), guild)
 
-                # Add the user to the thread if it already exists
-                for channel in self.bot.get_all_channels():
-                    if hasattr(channel, 'topic') and channel.topic is not None and channel.topic[9:13] == str(message.id)[-4:]:
-                        thread_channel : TextChannel = channel
-
-                        # Add the user to the thread if threads are hidden
-                        hide_threads = await self.config.guild(guild).hide_threads()
-                        if hide_threads:
-                            await thread_channel.set_permissions(member, read_messages=True)
-
-                        # Send the Welcome Message if it exists
-                        welcome_message = await self.config.guild(guild).welcome_message()
-                        if welcome_message and len(welcome_message) > 0:
-                            await thread_channel.send(welcome_message.replace("<@USER>", "<@" + str(member.id) +">"))
-
-                        return # End execution here
-                
-                # Otherwise, create the Thread Channel if it doesn't exist
-                if(thread_channel is None):
-                    # First, check if we should be limiting this member
-                    min_role_name = await self.config.guild(guild).min_role_to_create()
-                    guild_roles  : list[Role] = guild .roles
-                    member_roles : list[Role] = member.roles
-                    for role in guild_roles:
-                        if(str(min_role_name) == str(role)):
-                            if member_roles[-1].position < role.position:
-                                await message.remove_reaction(trigger_emoji, member)
-                                return # This user's role is too low to create a thread
-
-                    #if member.id in self.user_rate_limit:
-                    #    threads_per_hour = await self.config.guild(guild).user_threads_per_hour()
-                    #    if self.user_rate_limit[member.id] > datetime.now() - timedelta(days=threads_per_hour):
-                    #        await member.send(content="You can't create another thread yet; only "+str(threads_per_hour)+" per hour.")
-                    #        return
-
-                    # Set the permissions that let specific users see into this channel
-                    overwrites = {
-                        guild.default_role : discord.PermissionOverwrite(read_messages=(not await self.config.guild(guild).hide_threads())),
-                        guild.me           : discord.PermissionOverwrite(read_messages=True, manage_permissions=True),
-                        member             : discord.PermissionOverwrite(read_messages=True),
-                        message.author     : discord.PermissionOverwrite(read_messages=True)
-                    }
-                    thread_channel : TextChannel = await guild.create_text_channel(
-                        thread_name, overwrites=overwrites, topic="[THREAD] "+ str(message.id)[-4:] + " By <@" + str(message.author.id) +">: \n"+message.content, category=self.thread_category,
-                        position=self.thread_priority, reason = member.display_name + " added a :thread: emoji to " + message.author.display_name + "'s message.")
-                    logger.info(msg="[THREADWEAVER] "+member.display_name + " created a new thread: #" + thread_name + " from this message: \n"+message.jump_url)
-                    self.thread_priority = self.thread_priority - 1 # Decrement the thread priority so new threads are on top 
-
-                    # Create the Original Post in the Thread
-                    prefixes : list[str] = await self.bot.get_valid_prefixes(guild)
-                    embed = Embed(title="Discussion Thread", description=message.content, color=0x00ace6)
-                    embed.set_author(name=message.author.display_name, icon_url=message.author.avatar_url)
-                    embed.add_field (name="Commands", value=message.author.display_name+" may use `"+prefixes[0]+"rename-thread [NAME]` and `"+prefixes[0]+"archive-thread`\n[Jump to Original Message]("+message.jump_url+")")
-                    await thread_channel.send(content="<@" + str(message.author.id) +">'s thread opened by <@" + str(member.id) +">", embed = embed)
+                #if member.id in self.user_rate_limit:
+                #    threads_per_hour = settings["user_threads_per_hour"]
+                #    if self.user_rate_limit[member.id] > datetime.now() - timedelta(days=threads_per_hour):
+                #        await member.send(content="You can't create another thread yet; only "+str(threads_per_hour)+" per hour.")
+                #        return
+
+                # Set the permissions that let specific users see into this channel
+                overwrites = {
+                    guild.default_role : discord.PermissionOverwrite(read_messages=(not settings["hide_threads"])),
+                    guild.me           : discord.PermissionOverwrite(read_messages=True, manage_permissions=True),
+                    member             : discord.PermissionOverwrite(read_messages=True)
+                }
+                author : Member = guild.get_member(message.author_id)
+                if author is not None: # They may have left the server since posting
+                    overwrites[author] = discord.PermissionOverwrite(read_messages=True)
+                # Spill into an overflow category if the thread category is full
+                category : CategoryChannel = await self.reserve_thread_slot(guild, structure, settings)
+                try:
+                    thread_channel : TextChannel = await self.scheduler.run(guild, PRIORITY_INTERACTIVE, guild.create_text_channel,
+                        thread_name, overwrites=overwrites, topic="[THREAD] "+ str(message.id) + " By <@" + str(message.author_id) +">: \n"+message.content, category=category,
+                        position=self.thread_priority, reason = member.display_name + " added a :thread: emoji to " + message.author_display_name + "'s message.")
+                    structure.add_channel(thread_channel)
+                finally:
+                    structure.release(category.id)
+                self.register_thread(thread_channel) # Don't wait for the gateway event; another reaction may already be on its way
+                logger.info(msg="[THREADWEAVER] "+member.display_name + " created a new thread: #" + thread_name + " from this message: \n"+message.jump_url)
+                self.thread_priority = self.thread_priority - 1 # Decrement the thread priority so new threads are on top 
+
+            # Create the Original Post in the Thread
+            prefixes : list[str] = await self.bot.get_valid_prefixes(guild)
+            embed = Embed(title="Discussion Thread", description=message.content, color=0x00ace6)
+            embed.set_author(name=message.author_display_name, icon_url=message.author_avatar_url)
+            embed.add_field (name="Commands", value=message.author_display_name+" may use `"+prefixes[0]+"rename-thread [NAME]` and `"+prefixes[0]+"archive-thread`\n[Jump to Original Message]("+message.jump_url+")")
+            await self.scheduler.run(guild, PRIORITY_MESSAGE, thread_channel.send,
+                content="<@" + str(message.author_id) +">'s thread opened by <@" + str(member.id) +">", embed = embed)
 
     @Cog.listener()
+    @instrumented("reaction_remove")
     async def on_raw_reaction_remove(self, payload: RawReactionActionEvent) -> None:
             """
             Manage thread destruction and user permissions.
             """
-            # Get the metadata about the message's channel, and message itself
-            channel : TextChannel = discord.utils.get(self.bot.get_all_channels(), id=payload.channel_id)
-            message : Message     = await channel.fetch_message(payload.message_id)
-            guild   : Guild       = message.guild
+            # Is the emoji in the reaction a :thread:?  (Answered without any API calls or Config reads)
+            guild   : Guild       = self.bot.get_guild(payload.guild_id) if payload.guild_id is not None else None
             if guild is None:
                 return
+            settings : dict = await self.get_settings(guild)
+            if payload.emoji.name != settings["trigger_emoji"]:
+                return
 
-            # Is the emoji in the reaction a :thread:?
-            if payload.emoji.name == await self.config.guild(guild).trigger_emoji():
-                # If so, get the metadata about the message's member
-                member  : Member  = discord.utils.get(guild.members, id=payload.user_id)
-
-                thread_channel = None
-                thread_name    = await self.make_channel_friendly(await self.config.guild(guild).thread_prefix() + " " + 
-                                        str(message.author.name), guild)
-
-                # Remove the user from the thread
-                for channel in self.bot.get_all_channels():
-                    if hasattr(channel, 'topic') and channel.topic is not None and channel.topic[9:13] == str(message.id)[-4:]:
-                        thread_channel = channel
-
-                        # Send the Farewell Message if it exists
-                        farewell_message = await self.config.guild(guild).farewell_message()
-                        if farewell_message and len(farewell_message) > 0:
-                            await thread_channel.send(farewell_message.replace("<@USER>", "<@" + str(member.id) +">"))
-                        
-                        # Reset the users' Thread-Specific Permissions to Default
-                        await thread_channel.set_permissions(member, overwrite=None,
-                            reason = member.display_name + " removed their :thread: emoji from " + message.author.display_name + "'s message.")
+            # Remove the user from the thread, if the message has one
+            thread_channel : TextChannel = self.find_thread(guild, payload.message_id)
+            if thread_channel is not None:
+                self.queue_membership(thread_channel, payload.user_id, False, settings)